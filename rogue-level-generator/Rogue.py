@@ -1,9 +1,33 @@
+import hashlib
+import json
+import mmap
+import os
 import random
+import re
+import sqlite3
+import statistics
+import struct
+import tempfile
 import time
+import tracemalloc
+import zlib
 
+from array import array                 # compact arrays of C integers
+from bisect import bisect_left, bisect_right    # binary search in sorted lists
 from collections import deque           # double-ended queue
-from dataclasses import dataclass
-from typing import Tuple                # for the dataclass type definitions
+from collections import OrderedDict     # dictionary that remembers (and can change) the order of its keys
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from dataclasses import astuple, dataclass
+from heapq import heappop, heappush     # binary heap on top of a list
+from itertools import accumulate, chain, islice, repeat
+from operator import add, or_
+from typing import NamedTuple, Optional, List, Tuple     # for the dataclass type definitions
+
+try:
+    import numpy as np                  # only needed for LevelAnalytics ("analytics" mode)
+except ImportError:
+    np = None
 
 from settings import *
 
@@ -16,6 +40,181 @@ def namespace(cls):
     return cls
 
 
+def flag_table(*codes):
+    """
+    Builds a lookup table with one byte for each of the 256 possible tile codes: 1 if the code is in codes, else 0.
+    table[code] is a single index operation, which is a lot cheaper than comparing strings or searching a tuple.
+    """
+
+    table = bytearray(256)
+    for code in codes:
+        table[code] = 1
+
+    return bytes(table)
+
+
+def derive_seed(*parts):
+    """
+    Derives a seed of SEED_BITS bits from any number of parts, e.g. (world seed, "chunk", cx, cy).
+    hashlib instead of hash() because the result has to be identical in every process and every run (hash() of a
+    string changes with every start of the interpreter), and the workers of a process pool have to agree on it.
+    """
+
+    digest = hashlib.blake2b(repr(parts).encode(), digest_size=8).digest()
+
+    return int.from_bytes(digest, "big") >> (64 - SEED_BITS)
+
+
+@namespace
+class Tile:
+    """
+    Tile codes used by the TileMap. Every tile is stored as one byte, and that byte is simply the ASCII code of the
+    character defined in settings.py. This way, a map row decodes back to ASCII with a plain bytes.decode().
+
+    The flag tables answer the usual questions about a tile ("can I walk here?") by looking up its code.
+    """
+
+    ROCK            = ord(ROCK_TILE)
+    FLOOR           = ord(FLOOR_TILE)
+    CORRIDOR        = ord(CORRIDOR_TILE)
+    DOOR            = ord(STANDARD_DOOR)
+    EXIT            = ord(EXIT_TILE)
+    UP_STAIRS       = ord(UP_STAIRS_TILE)
+    HORIZONTAL_WALL = ord(H_WALL)
+    VERTICAL_WALL   = ord(V_WALL)
+
+    WALKABLE = flag_table(FLOOR, CORRIDOR, DOOR, EXIT, UP_STAIRS)
+    OPAQUE   = flag_table(ROCK, HORIZONTAL_WALL, VERTICAL_WALL)
+
+
+class TileMap:
+    """
+    The dungeon map as a compact grid: one byte per tile in a flat bytearray, stored row after row.
+    A list of lists of one-character strings costs a pointer (8 bytes) per tile plus the list overhead, so this is
+    a lot leaner when many levels are kept in memory at once.
+
+    Tile (x, y) lives at index y * width + x.
+
+    version counts the changes made through set(), so caches of things computed from the map (like the field of
+    view) can tell if they are outdated. Whoever writes to tiles directly has to call touch().
+    """
+
+    __slots__ = ("width", "height", "tiles", "version")
+
+    def __init__(self, width, height, fill=Tile.ROCK):
+        """
+        Create a width x height map filled with one tile code (rock, by default).
+        """
+
+        self.width   = width
+        self.height  = height
+        self.tiles   = bytearray([fill]) * (width * height)
+        self.version = 0
+
+    def in_bounds(self, x, y):
+        """
+        Checks if x,y is located on the map.
+        """
+
+        return 0 <= x < self.width and 0 <= y < self.height
+
+    def get(self, x, y):
+        """
+        Returns the tile code at x,y.
+        """
+
+        return self.tiles[y * self.width + x]
+
+    def set(self, x, y, code):
+        """
+        Stores a tile code at x,y.
+        """
+
+        self.tiles[y * self.width + x] = code
+        self.version += 1
+
+    def touch(self):
+        """
+        Marks the map as changed after writing to tiles directly.
+        """
+
+        self.version += 1
+
+    def set_many(self, points, code):
+        """
+        Stores the same tile code at many x,y positions in one pass: plain index writes into the bytearray, without
+        a method call and a version bump per tile like set().
+        """
+
+        tiles, width = self.tiles, self.width
+        for x, y in points:
+            tiles[y * width + x] = code
+        self.version += 1
+
+    def is_walkable(self, x, y):
+        """
+        Checks if x,y is on the map and the player can walk there.
+        """
+
+        return self.in_bounds(x, y) and Tile.WALKABLE[self.tiles[y * self.width + x]] == 1
+
+    def rows(self):
+        """
+        Decodes the map back into ASCII, one string per row.
+        """
+
+        width = self.width
+        return [self.tiles[start:start + width].decode("ascii") for start in range(0, len(self.tiles), width)]
+
+
+@dataclass(frozen=True)
+class GeneratorConfig:
+    """
+    Everything that shapes a generated level, in one object that is handed to Dungeon, Room.generate_rooms and the
+    Corridor functions. The defaults are the constants from settings.py, so GeneratorConfig() is the classic
+    80 x 25 console level. Since every Dungeon carries its own config, one process (or one worker pool) can build
+    console levels and huge overworld maps side by side.
+
+    It is frozen, so it can be hashed, shared between levels, and pickled to worker processes.
+    """
+
+    width                     : int   = LEVEL_WIDTH
+    height                    : int   = LEVEL_HEIGHT
+    min_room_size             : int   = MIN_ROOM_SIZE
+    max_room_size             : int   = MAX_ROOM_SIZE
+    room_buffer               : int   = ROOM_BUFFER
+    max_attempts              : int   = MAX_ATTEMPTS
+    min_rooms                 : int   = MIN_ROOMS
+    max_rooms                 : int   = MAX_ROOMS
+    placement_probes          : int   = PLACEMENT_PROBES
+    extra_corridor_distance   : int   = THRESHOLD_DISTANCE_FOR_EXTRA_CORRIDORS
+    extra_corridor_probability: float = PROBABILITY_FOR_EXTRA_CORRIDOR_CREATION
+    router                    : str   = CORRIDOR_ROUTER
+    dense_mst_limit           : int   = DENSE_MST_LIMIT
+
+    @classmethod
+    def preset(cls, name):
+        """
+        Creates the config for a named preset from GENERATOR_PRESETS in settings.py.
+        """
+
+        if name not in GENERATOR_PRESETS:
+            raise ValueError(f"Unknown generator preset: {name}")
+
+        return cls(**GENERATOR_PRESETS[name])
+
+    def fingerprint(self):
+        """
+        Hashes all settings that have an influence on the generated level, i.e. all fields plus the BFS switch
+        distance (both BFS variants find shortest paths, but not always the same ones).
+        Stable across processes and runs for the same reason as derive_seed.
+        """
+
+        generation_settings = (astuple(self), BFS_BIDIRECTIONAL_DISTANCE)
+
+        return hashlib.sha1(repr(generation_settings).encode()).hexdigest()[:16]
+
+
 # @dataclass automatically generates the __init__ function and indicates a class that mostly stores data-
 @dataclass
 class Room:
@@ -28,7 +227,6 @@ class Room:
     width: int
     height: int
     id: int
-    visible: bool = False
 
     @property       # this generates a pseudo-attribute room.center instead of room.center()
     def center(self):
@@ -74,40 +272,66 @@ class Room:
         )
 
     @staticmethod
-    def generate_rooms():
+    def generate_rooms(rng=random, config=None, instrumentation=None):
         """
         Generates a list of non-overlapping rooms
 
         The function attempts to create a random number of rooms within the limit.
         The rooms are placed non-overlapping, keeping a buffer space around them.
+
+        All generation functions take the random number generator as rng. It defaults to the random module itself,
+        which offers the same functions as a random.Random instance. Level size and room limits come from config
+        (a GeneratorConfig, None means the defaults from settings.py). instrumentation (an Instrumentation) counts
+        the attempts and why they failed.
         """
 
-        target_room_count = random.randint(MIN_ROOMS, MAX_ROOMS)
+        if config is None:
+            config = GeneratorConfig()
+
+        target_room_count = rng.randint(config.min_rooms, config.max_rooms)
 
+        placer       = RoomPlacer(config.width, config.height, config.room_buffer)
         rooms        =   []
         attempts     =    0         # defining this here means MAX_ATTEMPTS attempts for the complete generation process
         room_id      =    0
+        failed_sizes =   []         # room sizes for which no free position was left
 
-        while len(rooms) < target_room_count and attempts <= MAX_ATTEMPTS:
+        while len(rooms) < target_room_count and attempts <= config.max_attempts:
             attempts += 1           # instead, "attempts = 0" defined here would give MAX_ATTEMPTS for each room generation
 
-            # I first pick the size of the room and then find a preliminary position in the map.
-            # Theoretically, this order could be reversed (find a position, then choose a suitable size).
-            width  = random.randint(MIN_ROOM_SIZE, MAX_ROOM_SIZE)   # first, pick room size
-            height = random.randint(MIN_ROOM_SIZE, MAX_ROOM_SIZE)
+            # I first pick the size of the room and then let the RoomPlacer find a position in the map.
+            # The placer only returns positions that are actually free, so an attempt only fails if there is no space
+            # left at all for a room of this size.
+            width  = rng.randint(config.min_room_size, config.max_room_size)    # first, pick room size
+            height = rng.randint(config.min_room_size, config.max_room_size)
 
-            x = random.randint(1, LEVEL_WIDTH  - width - 1)       # then, choose room position
-            y = random.randint(1, LEVEL_HEIGHT - height - 1)
+            if instrumentation:
+                instrumentation.count("placement_attempts")
 
-            # Now, create the room as an instance of the Room class and check for overlap.
-            # If it fits, add the room to the level layout. If not, proceed with a new attempt.
-            new_room = Room(x, y, width, height, room_id)
-            if any(new_room.intersects(other, ROOM_BUFFER) for other in rooms):
+            # If a smaller (or equal) room did not fit anywhere, this one won't either. No need to look again.
+            if any(width >= failed_width and height >= failed_height for failed_width, failed_height in failed_sizes):
+                if instrumentation:
+                    instrumentation.count("placement_failures")
+                continue
+
+            # then, choose room position
+            position = placer.place(width, height, rng, config.placement_probes, instrumentation)
+            if position is None:
+                if instrumentation:
+                    instrumentation.count("placement_failures")
                 if DEBUG_MODE["room_generation"]:
-                    print(f"Room {room_id} overlaps with another room.")
+                    print(f"No space left for a {width} x {height} room.")
+                failed_sizes.append((width, height))
+                if width == config.min_room_size and height == config.min_room_size:
+                    break                                           # the map is full
                 continue
+
+            # Now, create the room as an instance of the Room class and mark it (plus buffer) as occupied.
+            x, y = position
+            new_room = Room(x, y, width, height, room_id)
+            placer.occupy(new_room)
             if DEBUG_MODE["room_generation"]:
-                print(f"Room {room_id} created at attempt {attempts}. {MAX_ATTEMPTS - attempts} attempts left.")
+                print(f"Room {room_id} created at attempt {attempts}. {config.max_attempts - attempts} attempts left.")
             rooms.append(new_room)
             room_id += 1
 
@@ -118,19 +342,423 @@ class Room:
         """
         "Draws" (stores as ASCII characters) a room on the dungeon level map.
         At this point, rooms consist of H_WALLs and V_WALLs plus FLOOR_TILEs, but no doors.
+
+        Every row of a room is one slice of the map's bytearray, so I build the two kinds of rows once and assign
+        them as slices instead of setting tile by tile.
+        """
+
+        tiles, width = dungeon_map.tiles, dungeon_map.width
+        wall   = bytes([Tile.HORIZONTAL_WALL]) * room.width                 # top and bottom boundaries
+        middle = bytes([Tile.VERTICAL_WALL]) + bytes([Tile.FLOOR]) * (room.width - 2) + bytes([Tile.VERTICAL_WALL])
+
+        for y in range(room.y, room.y + room.height):
+            start = y * width + room.x
+            tiles[start:start + room.width] = wall if y in (room.y, room.y + room.height - 1) else middle
+
+        dungeon_map.touch()
+
+
+class RoomPlacer:
+    """
+    Placement engine for rooms, replacing the old "pick a random rectangle and compare it with every room" approach.
+
+    It keeps an occupancy bitmap of the level (1 for every tile covered by a room or its buffer margin) and
+    summed-area tables of that bitmap: sat[y][x] is the number of occupied tiles in the rectangle from (0, 0) to
+    (x - 1, y - 1). The number of occupied tiles in any rectangle then takes four lookups, no matter how many rooms
+    have been placed: https://en.wikipedia.org/wiki/Summed-area_table
+
+    A new room fits if its rectangle contains no occupied tile. Since the buffer is already part of the bitmap,
+    this is the same test as Room.intersects(other, buffer) against all other rooms.
+
+    One table for the whole level would have to be recalculated from the new room downwards after every placement,
+    which gets expensive on big maps. So the level is split into blocks of SAT_BLOCK_SIZE x SAT_BLOCK_SIZE tiles with
+    one table each. A placement only touches the blocks under the room, and a room rectangle covers at most a few
+    blocks, so checks stay O(1). Blocks without any occupied tile have no table at all (None).
+
+    When the random probes fail, the placer picks from all free positions instead. For that, the bitmap is also kept packed
+    into one integer per row, where whole rows can be combined with a few bit operations.
+    """
+
+    def __init__(self, width, height, buffer=ROOM_BUFFER, block_size=SAT_BLOCK_SIZE):
+        """
+        Create an empty width x height level.
+        """
+
+        self.width      = width
+        self.height     = height
+        self.buffer     = buffer
+        self.block_size = block_size
+        self.blocks_x   = -(-width  // block_size)          # ceiling division
+        self.blocks_y   = -(-height // block_size)
+        self.occupied   = bytearray(width * height)
+        self.rows       = [0] * height                      # the same bitmap packed into one integer per row
+        self.sats       = [None] * (self.blocks_x * self.blocks_y)
+        self.dirty      = [None] * (self.blocks_x * self.blocks_y)  # first row per block that changed since its update
+
+    def occupied_count(self, x, y, width, height):
+        """
+        Returns the number of occupied tiles in the rectangle with top left corner x,y.
+        The rectangle is cut into one piece per block, and each piece takes four lookups in that block's table.
+        """
+
+        size  = self.block_size
+        total = 0
+
+        for block_y in range(y // size, (y + height - 1) // size + 1):
+            origin_y = block_y * size
+            top      = max(y, origin_y) - origin_y                  # rows of the piece, relative to the block
+            bottom   = min(y + height, origin_y + size) - origin_y
+
+            for block_x in range(x // size, (x + width - 1) // size + 1):
+                index = block_y * self.blocks_x + block_x
+                if self.dirty[index] is not None:                   # bring the table up to date first
+                    self.update_sat(block_x, block_y)
+                sat = self.sats[index]
+                if sat is None:                                     # nothing placed in this block yet
+                    continue
+
+                origin_x = block_x * size
+                left     = max(x, origin_x) - origin_x              # columns of the piece, relative to the block
+                right    = min(x + width, origin_x + size) - origin_x
+                stride   = min(size, self.width - origin_x) + 1
+
+                total += (sat[bottom * stride + right] - sat[top * stride + right]
+                          - sat[bottom * stride + left] + sat[top * stride + left])
+
+        return total
+
+    def fits(self, x, y, width, height):
+        """
+        Checks if a room can be placed with its top left corner at x,y.
+        """
+
+        return self.occupied_count(x, y, width, height) == 0
+
+    def blocked_columns(self, y, width, height):
+        """
+        Returns the positions x in row y where a width x height room would overlap something, as bits of an integer.
+
+        This uses the packed bitmap rows (one Python integer per row, bit x = tile x): ORing the rows y to
+        y + height - 1 gives every column that is occupied somewhere in the room's height. A room at x covers
+        the columns x to x + width - 1, so x is blocked if any of them is occupied; shifting right by 1, 2, 4, ...
+        and ORing spreads every occupied column to the width - 1 positions to its left in a few steps.
+        """
+
+        columns = 0
+        for row in self.rows[y:y + height]:
+            columns |= row
+
+        blocked, spread = columns, 1
+        while spread < width:
+            step     = min(spread, width - spread)
+            blocked |= blocked >> step
+            spread  += step
+
+        return blocked
+
+    def free_columns(self, y, width, height):
+        """
+        Returns the positions x in row y where a width x height room fits, as bits of an integer.
+        Rooms keep one tile of rock to the level border (the same range as in the old random.randint calls),
+        so only x = 1 ... level width - width - 1 count.
+        """
+
+        valid_range = ((1 << (self.width - width - 1)) - 1) << 1
+
+        return ~self.blocked_columns(y, width, height) & valid_range
+
+    def place(self, width, height, rng=random, probes=PLACEMENT_PROBES, instrumentation=None):
+        """
+        Finds a free position for a width x height room, or None if there is none.
+
+        On an empty map, nearly every random position is free, so I first try a few random probes (each one is O(1)).
+        If they all fail, the map is crowded, and I sample directly from all valid positions instead of guessing on.
+        This way, a room is found whenever there is space for it. To avoid building a list of all positions,
+        I count the free positions per row (bit_count of the packed rows), pick the n-th free position of the map,
+        and only then look up its x.
+
+        instrumentation (an Instrumentation) counts the probes that hit an occupied area.
+        """
+
+        for _ in range(probes):
+            x = rng.randint(1, self.width  - width  - 1)
+            y = rng.randint(1, self.height - height - 1)
+            if self.fits(x, y, width, height):
+                return x, y
+            if instrumentation:
+                instrumentation.count("overlap_rejections", x=x, y=y, width=width, height=height)
+
+        rows        = range(1, self.height - height)
+        free_counts = [self.free_columns(y, width, height).bit_count() for y in rows]
+
+        total = sum(free_counts)
+        if total == 0:
+            return None
+
+        n = rng.randrange(total)                        # pick the n-th free position of the whole map
+        for y, count in zip(rows, free_counts):
+            if n < count:
+                break
+            n -= count
+
+        x = next(islice(Utilities.set_bits(self.free_columns(y, width, height)), n, None))
+
+        return x, y
+
+    def occupy(self, room):
+        """
+        Marks a room plus its buffer margin as occupied (clipped to the level) and marks the affected blocks dirty.
+        Their tables are only recalculated when they are needed for the next check, and only from the first row
+        that changed.
+        """
+
+        x0 = max(room.x - self.buffer, 0)
+        x1 = min(room.x + room.width + self.buffer, self.width)
+        y0 = max(room.y - self.buffer, 0)
+        y1 = min(room.y + room.height + self.buffer, self.height)
+
+        row_mask = ((1 << (x1 - x0)) - 1) << x0
+        for row in range(y0, y1):
+            start = row * self.width
+            self.occupied[start + x0:start + x1] = b"\x01" * (x1 - x0)
+            self.rows[row] |= row_mask
+
+        size = self.block_size
+        for block_y in range(y0 // size, (y1 - 1) // size + 1):
+            for block_x in range(x0 // size, (x1 - 1) // size + 1):
+                index     = block_y * self.blocks_x + block_x
+                first_row = max(y0 - block_y * size, 0)
+                if self.dirty[index] is None or first_row < self.dirty[index]:
+                    self.dirty[index] = first_row
+
+    def update_sat(self, block_x, block_y):
+        """
+        Recalculates the summed-area table of one block from its first dirty row (relative to the block) downwards.
+        Rows above the changed area keep their values. Each row is the row above plus the running sum of the bitmap
+        row, with accumulate() and map() doing the loops in C.
+        """
+
+        size          = self.block_size
+        origin_x      = block_x * size
+        origin_y      = block_y * size
+        block_width   = min(size, self.width  - origin_x)
+        block_height  = min(size, self.height - origin_y)
+        stride        = block_width + 1
+
+        index = block_y * self.blocks_x + block_x
+        if self.sats[index] is None:
+            self.sats[index] = [0] * (stride * (block_height + 1))
+        sat, first_row, self.dirty[index] = self.sats[index], self.dirty[index], None
+
+        for row in range(first_row, block_height):
+            start       = (origin_y + row) * self.width + origin_x
+            running_sum = accumulate(self.occupied[start:start + block_width], initial=0)
+            sat[(row + 1) * stride:(row + 2) * stride] = map(add, sat[row * stride:(row + 1) * stride], running_sum)
+
+
+class RoomGrid:
+    """
+    Per-tile room index: for every tile of the level, the ID of the room covering it (walls included) or -1.
+    It is built once after the rooms have been placed, and afterwards "which room is at x,y?" is one lookup instead of
+    a loop over all rooms. Room IDs are the positions in the rooms list, so rooms[room_id] is the room itself.
+
+    The IDs are stored as 32-bit integers, so even levels with hundreds of thousands of rooms fit.
+    """
+
+    __slots__ = ("width", "height", "rooms", "cells")
+
+    def __init__(self, width, height, rooms=()):
+        """
+        Create the index for a width x height level and enter all rooms.
+        """
+
+        self.width  = width
+        self.height = height
+        self.rooms  = list(rooms)
+        self.cells  = array("i", [-1]) * (width * height)
+
+        for room in self.rooms:
+            row = array("i", [room.id]) * room.width        # one row of the room, copied in with a slice per line
+            for y in range(room.y, room.y + room.height):
+                start = y * width + room.x
+                self.cells[start:start + room.width] = row
+
+    def room_id_at(self, x, y):
+        """
+        Returns the ID of the room at x,y, or -1 for tiles outside of rooms (and outside of the level).
+        """
+
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return self.cells[y * self.width + x]
+
+        return -1
+
+
+class ObstacleMap:
+    """
+    The obstacle bitmap for corridor routing, built once per dungeon: 1 for every tile that belongs to a room
+    (walls and floor), 0 for rock. The old BFS collected all room tiles into a fresh set on every single call.
+
+    The object also owns the scratch arrays of the searches, so they are allocated at most once per dungeon, too:
+    - parent[i] is the tile index a search came from when it reached tile i (flat, one entry per tile),
+    - seen[i] holds the number of the search that reached tile i. A new search simply uses a new number,
+      so nothing has to be cleared between searches.
+    Each array exists twice, for the two directions of a bidirectional search. They are only allocated by the first
+    search (levels with nothing but L-shaped corridors never need them), and the whole map is dropped once the
+    corridors are dug, because the arrays are several times the size of the level itself.
+    The same goes for the row stops of jump point search (see row_stops).
+    """
+
+    WALL_START = re.compile(b"\x00\x01")                # an open tile followed by a blocked one
+    WALL_END   = re.compile(b"\x01\x00")                # and the other way round
+
+    def __init__(self, room_grid):
+        """
+        Derive the bitmap from the room grid: every tile with a room ID is an obstacle.
+        """
+
+        self.width   = room_grid.width
+        self.height  = room_grid.height
+        self.blocked = bytearray(map((-1).__ne__, room_grid.cells))     # True/False become 1/0
+
+        self.parent = None                                  # scratch arrays, see new_search
+        self.seen   = None
+        self.cost   = None                                  # path lengths for A* and jump point search
+        self.search = 0
+        self.doors  = ()                                    # the doors opened for the current search
+        self.stops  = {}                                    # row -> stops of horizontal jumps, see row_stops
+
+    def new_search(self):
+        """
+        Starts a new search: allocates the scratch arrays if this is the first one, and returns the search number.
+        """
+
+        if self.parent is None:
+            size = self.width * self.height
+            self.parent = (array("i", [-1]) * size, array("i", [-1]) * size)
+            self.seen   = (array("I", [0]) * size, array("I", [0]) * size)
+            self.cost   = array("i", [0]) * size
+
+        self.search += 1
+        return self.search
+
+    @contextmanager
+    def opened(self, door1, door2):
+        """
+        Opens up the two door tiles for one search (they are part of their rooms' walls, so they are obstacles).
+        Yields the tile indices of the doors and closes them again afterwards.
+
+        with obstacles.opened(door1, door2) as (start, target):
+            ...
+        """
+
+        start   = door1[1] * self.width + door1[0]
+        target  = door2[1] * self.width + door2[0]
+        blocked = self.blocked
+
+        saved = blocked[start], blocked[target]
+        blocked[start] = blocked[target] = 0
+        self.doors = tuple(door for door, was_blocked in zip((start, target), saved) if was_blocked)
+        try:
+            yield start, target
+        finally:
+            blocked[start], blocked[target] = saved
+            self.doors = ()
+
+    def to_path(self, indices):
+        """
+        Turns a list of tile indices into a list of x,y tuples (or passes on None).
+        """
+
+        if indices is None:
+            return None
+
+        return [(index % self.width, index // self.width) for index in indices]
+
+    def neighbors(self, index):
+        """
+        Returns the tile indices right, left, below and above of index (the order of the old BFS) that are
+        inside the level and not blocked.
+        """
+
+        width, blocked = self.width, self.blocked
+        x = index % width
+        result = []
+
+        if x < width - 1 and not blocked[index + 1]:
+            result.append(index + 1)
+        if x > 0 and not blocked[index - 1]:
+            result.append(index - 1)
+        if index + width < len(blocked) and not blocked[index + width]:
+            result.append(index + width)
+        if index >= width and not blocked[index - width]:
+            result.append(index - width)
+
+        return result
+
+    def closed_row(self, y):
+        """
+        Row y of the bitmap as bytes, with the doors of the current search closed again.
+        """
+
+        row = bytearray(self.blocked[y * self.width:(y + 1) * self.width])
+        for door in self.doors:
+            if door // self.width == y:
+                row[door % self.width] = 1
+
+        return row
+
+    def row_stops(self, y):
+        """
+        For jump point search: the x positions in row y where a horizontal jump has to stop, as two sorted lists
+        (jumps to the right, jumps to the left). A jump stops at the first tile of a wall, and at every tile where
+        a vertical turn becomes possible that was blocked one tile earlier (the "forced neighbors"). The lists end
+        in a sentinel beyond the border of the map.
+
+        The doors of the current search count as walls here, so every row is looked at only once per dungeon, not
+        once per search. The regular expressions find all the edges of a row in C, so open rock costs hardly anything.
+        """
+
+        stops = self.stops.get(y)
+        if stops is not None:
+            return stops
+
+        width     = self.width
+        row       = self.closed_row(y)
+        neighbors = [self.closed_row(other) for other in (y - 1, y + 1) if 0 <= other < self.height]
+
+        right = {match.start() + 1 for match in self.WALL_START.finditer(row)}          # walls ahead
+        left  = {match.start() for match in self.WALL_END.finditer(row)}
+        if row[0]:
+            right.add(0)
+        if row[-1]:
+            left.add(width - 1)
+        for other in neighbors:                                 # open tiles next to a blocked one, above and below
+            right.update(match.start() + 1 for match in self.WALL_END.finditer(other))
+            left.update(match.start() for match in self.WALL_START.finditer(other))
+            if not other[0]:
+                right.add(0)
+            if not other[-1]:
+                left.add(width - 1)
+
+        stops = (sorted(right) + [width], [-1] + sorted(left))
+        self.stops[y] = stops
+
+        return stops
+
+    def trace(self, index, direction=0):
+        """
+        Follows the parent pointers of one search direction from index back to its start.
+        Returns the tile indices from index to the start.
         """
 
-        for x in range(room.x, room.x + room.width):                # draw H_WALLs in the first and last line
-            dungeon_map[room.y][x] = H_WALL                         # as top and bottom boundaries
-            dungeon_map[room.y + room.height - 1][x] = H_WALL
+        parent, path = self.parent[direction], []
 
-        for y in range(room.y + 1, room.y + room.height - 1):       # between the first and last line,
-            dungeon_map[y][room.x] = V_WALL                         # draw V_WALLs as left and right boundaries
-            dungeon_map[y][room.x + room.width - 1] = V_WALL
+        while index != -1:
+            path.append(index)
+            index = parent[index]
 
-        for y in range(room.y + 1, room.y + room.height - 1):       # fill everything inbetween with FLOOR_TILEs
-            for x in range(room.x + 1, room.x + room.width - 1):
-                dungeon_map[y][x] = FLOOR_TILE
+        return path
 
 
 @namespace
@@ -142,7 +770,7 @@ class Door:
     """
 
     @staticmethod
-    def choose_door(room, other_room):
+    def choose_door(room, other_room, rng=random):
         """
         Find a suitable position for a door on the wall of room, based on the location of other_room.
 
@@ -161,18 +789,18 @@ class Door:
         if abs(ocx - rcx) > abs(ocy - rcy):       # horizontal distance exceeds vertical distance
             if ocx > rcx:                         # -> create door within left wall
                 door_x = room.x + room.width - 1
-                door_y = random.randint(room.y + 1, room.y + room.height - 2)
+                door_y = rng.randint(room.y + 1, room.y + room.height - 2)
             else:                                 # -> create door within right wall
                 door_x = room.x
-                door_y = random.randint(room.y + 1, room.y + room.height - 2)
+                door_y = rng.randint(room.y + 1, room.y + room.height - 2)
 
         else:                                     # vertical distance exceeds horizontal distance
             if ocy > rcy:                         # -> create door within top wall
                 door_y = room.y + room.height - 1
-                door_x = random.randint(room.x + 1, room.x + room.width - 2)
+                door_x = rng.randint(room.x + 1, room.x + room.width - 2)
             else:                                 # -> create door within bottom wall
                 door_y = room.y
-                door_x = random.randint(room.x + 1, room.x + room.width - 2)
+                door_x = rng.randint(room.x + 1, room.x + room.width - 2)
 
         return door_x, door_y
 
@@ -192,9 +820,11 @@ class Corridor:
     door1: Tuple[int, int]
     door2: Tuple[int, int]
     path : Tuple[Tuple[int, int]]
+    mode : str = "hv"       # how the path was found: "hv", "vh", or the name of the router
+    expanded: int = 0       # number of nodes the router expanded for this corridor (0 for L-shaped corridors)
 
     @staticmethod
-    def connect_rooms_by_mst(rooms):
+    def connect_rooms_by_mst(rooms, rng=random, config=None):
         """
         Connect all rooms using a Minimum Spanning Tree (MST) algorithm.
         Some literature about the algorithm is mentioned at the beginning of this code, and I stole the basic
@@ -211,35 +841,153 @@ class Corridor:
 
         The algorithm proceeds iteratively by selecting the closest unconnected room to an already connected room
         in order to make sure that all rooms will finally belong to a connected system.
+
+        This is Prim's algorithm (https://en.wikipedia.org/wiki/Prim%27s_algorithm) with a binary heap. My first
+        version compared every connected room with every unconnected room in every step, which is cubic in the number
+        of rooms and falls over with hundreds of them. Now every unconnected room remembers its closest connected room,
+        and only the newly connected room has to be compared with the others. The heap then hands out the closest
+        unconnected room. Outdated heap entries (a closer room was found later, or the room is already connected) are
+        simply skipped. On ties, the room that was connected first and then the room with the lower index win, which
+        is exactly what the old loops did, so the levels don't change.
+
+        This is still quadratic, because every room is compared with every other room once. Above
+        config.dense_mst_limit rooms, connect_rooms_by_kruskal takes over.
         """
 
-        connected      = [rooms[0]]     # start with room 0,
-        not_connected  = rooms[1:]      # mark all other rooms unconnected,
-        corridor_edges = []             # and prepare an empty list for the corridors.
+        if config is None:
+            config = GeneratorConfig()
+
+        if not rooms:
+            return []
+        if len(rooms) > config.dense_mst_limit:
+            return Corridor.connect_rooms_by_kruskal(rooms, rng)
+
+        centers  = [room.center for room in rooms]      # the room centers are computed once, not in every step
+        count    = len(rooms)
+        distance = [None] * count                       # distance to the closest connected room, and its
+        nearest  = [0] * count                          # position in the connected list
+        done     = [False] * count
+        done[0]  = True                                 # start with room 0,
+        connected      = [0]
+        corridor_edges = []                             # and prepare an empty list for the corridors.
+        heap           = []
+
+        while len(connected) < count:
+            order  = len(connected) - 1                 # the room connected last is the only new candidate
+            ax, ay = centers[connected[order]]
+
+            for index in range(count):
+                if not done[index]:
+                    bx, by = centers[index]
+                    dist = abs(ax - bx) + abs(ay - by)  # Manhattan distance (see below for explanation)
+                    if distance[index] is None or dist < distance[index]:
+                        distance[index], nearest[index] = dist, order
+                        heappush(heap, (dist, order, index))
+
+            while True:
+                dist, order, index = heappop(heap)
+                if not done[index] and dist == distance[index] and order == nearest[index]:
+                    break                                               # the best target room, if not outdated
+
+            room_a, room_b = rooms[connected[order]], rooms[index]
+            door_a = Door.choose_door(room_a, room_b, rng)              # find door coordinates
+            door_b = Door.choose_door(room_b, room_a, rng)
 
-        while not_connected:
-            best_distance, best_pair = None, None
+            corridor_edges.append((room_a, room_b, door_a, door_b))     # remember the corridor and
+            connected.append(index)                                     # mark room b as connected
+            done[index] = True
+
+        return corridor_edges
 
-            for room_a in connected:            # we are looking for short connections from rooms in the connected list
-                for room_b in not_connected:    # to rooms in the not_connected list
-                    dx = abs(room_a.center[0] - room_b.center[0])       # Manhattan distance (see below for explanation)
-                    dy = abs(room_a.center[1] - room_b.center[1])
-                    dist = dx + dy
+    @staticmethod
+    def connect_rooms_by_kruskal(rooms, rng=random):
+        """
+        The MST for levels with many rooms (Kruskal's algorithm: https://en.wikipedia.org/wiki/Kruskal%27s_algorithm).
 
-                    if best_distance is None or dist < best_distance:   # if this is the best target room, remember it
-                        best_distance = dist
-                        best_pair = (room_a, room_b)
+        Comparing all pairs is hopeless for thousands of rooms, but with Manhattan distances, only a few pairs per room
+        can be part of an MST at all: split the plane around a room into eight 45 degree wedges, and only the closest
+        room in each wedge is a candidate. manhattan_mst_candidates finds these pairs in O(n log n).
+        Kruskal then walks through the candidates from the shortest to the longest and keeps every pair that connects
+        two rooms that are not connected yet. "Connected yet?" is answered by a union-find structure.
 
-            room_a, room_b = best_pair                                  # unpack the result
-            door_a = Door.choose_door(room_a, room_b)                   # find door coordinates
-            door_b = Door.choose_door(room_b, room_a)
+        The total corridor length is the same as with connect_rooms_by_mst, but on ties the chosen pairs may differ,
+        which is why small levels still use the other function.
+        """
 
-            corridor_edges.append((room_a, room_b, door_a, door_b))     # remember the corridor and
-            connected.append(room_b)                                    # update the connected and not_connected lists
-            not_connected.remove(room_b)
+        centers = [room.center for room in rooms]
+        edges   = sorted(
+            (abs(centers[i][0] - centers[j][0]) + abs(centers[i][1] - centers[j][1]), min(i, j), max(i, j))
+            for i, j in Corridor.manhattan_mst_candidates(centers)
+        )
+
+        parent = list(range(len(rooms)))                # union-find: every room starts as its own group
+
+        def find(index):
+            while parent[index] != index:
+                parent[index] = parent[parent[index]]   # path halving keeps the trees flat
+                index = parent[index]
+            return index
+
+        corridor_edges = []
+        for _, i, j in edges:
+            group_i, group_j = find(i), find(j)
+            if group_i == group_j:                      # already connected, this pair would close a loop
+                continue
+            parent[group_j] = group_i
+
+            room_a, room_b = rooms[i], rooms[j]
+            door_a = Door.choose_door(room_a, room_b, rng)
+            door_b = Door.choose_door(room_b, room_a, rng)
+            corridor_edges.append((room_a, room_b, door_a, door_b))
+
+            if len(corridor_edges) == len(rooms) - 1:   # a tree with n rooms has n - 1 corridors
+                break
 
         return corridor_edges
 
+    @staticmethod
+    def manhattan_mst_candidates(points):
+        """
+        Returns pairs of point indices (i, j) that contain a Manhattan MST of the points.
+
+        For each point, this finds the closest point in each of the eight wedges around it. One wedge is handled with
+        a sweep: the points are sorted by x + y, and a sorted list (by -y) keeps the points that have not found their
+        closest partner in the wedge yet. Each point is the closest one for every waiting point it "covers", and these
+        are removed. Mirroring and swapping the coordinates between the four rounds covers the other wedges (each pair
+        counts for both directions, so four rounds are enough).
+        This is the well-known sweep from competitive programming, e.g. in the KTH team reference (KACTL).
+        """
+
+        points = [list(point) for point in points]
+        order  = list(range(len(points)))
+        pairs  = []
+
+        for turn in range(4):
+            order.sort(key=lambda i: points[i][0] + points[i][1])
+            keys, waiting = [], []                      # sweep list: -y of the waiting points, and their indices
+
+            for i in order:
+                x, y  = points[i]
+                start = end = bisect_left(keys, -y)
+                while end < len(keys):
+                    j = waiting[end]
+                    if y - points[j][1] > x - points[j][0]:     # outside the wedge, and so is everything after it
+                        break
+                    pairs.append((i, j))
+                    end += 1
+
+                del keys[start:end], waiting[start:end]
+                keys.insert(start, -y)
+                waiting.insert(start, i)
+
+            for point in points:
+                if turn & 1:
+                    point[0] = -point[0]
+                else:
+                    point[0], point[1] = point[1], point[0]
+
+        return pairs
+
     @staticmethod
     def get_corridor_candidate_path(door1, door2, order="hv"):
         """
@@ -290,27 +1038,26 @@ class Corridor:
         return corridor_path
 
     @staticmethod
-    def is_valid_corridor(corridor_path, all_rooms):
+    def is_valid_corridor(corridor_path, obstacles):
         """
         Check if a corridor is valid: Corridors may not run through rooms (neither walls nor floor tiles),
         except at the two doors at the start and end points.
 
         Function iterates all coordinates in the path except the first and last (the doors)
-        and checks for intersections with walls or floor tiles.
+        and looks them up in the obstacle bitmap (which is derived from the room grid).
+        This used to be a loop over all rooms for every tile.
         """
 
-        for index, (x, y) in enumerate(corridor_path):
-            if index == 0 or index == len(corridor_path) - 1:   # skip the doors
-                continue
+        blocked, width = obstacles.blocked, obstacles.width
 
-            for room in all_rooms:              # a faster alternative would be looking at the map and excluding
-                if room.contains(x, y):         # fields other than ROCK und CORRIDOR
-                    return False
+        for x, y in corridor_path[1:-1]:                        # skip the doors
+            if blocked[y * width + x]:
+                return False
 
         return True
 
     @staticmethod
-    def bfs_path(door1, door2, room1, room2, all_rooms):
+    def bfs_path(door1, door2, obstacles, bidirectional=None):
         """
         This is the complicated part: The function uses a Breadth-First Search (BFS) algorithm
         to find a valid path between two doors while avoiding room interiors.
@@ -321,319 +1068,2726 @@ class Corridor:
         I mixed an old C code I wrote with a clean implementation of the algorithm (reference see above).
 
         BFS implementation, cf. literature given above from which I have stolen the fundamentals ;) :
-        - Collect all room interior coordinates as "obstacles", excluding the door positions of room1 and room2.
+        - All room tiles are "obstacles". The bitmap is built once per dungeon (ObstacleMap), and only the two door
+          tiles are opened up for the duration of this search.
         - Uses a double-ended queue (or deque) to explore paths and find the shortest possible path.
         - Expand in all four directions while neither revisiting nodes nor entering obstacles.
-        - Each node stores its full path history so it can be reconstructed when reaching door2.
-          Maybe this high memory usage is the reason that the algorithm was not used in some 1980s rogue(like) games?
+        - The first version stored the full path history in every queued node, so memory grew with the square of the
+          path length. Maybe this high memory usage is the reason that the algorithm was not used in some 1980s
+          rogue(like) games? Now, every tile only remembers the tile it was reached from (a parent pointer), and the
+          path is traced back once at the end.
         - However, BFS guarantees that the first time door2 is reached, this is already the shortest possible route.
 
+        For long routes (bidirectional=None picks this automatically from BFS_BIDIRECTIONAL_DISTANCE), the search
+        runs from both doors at once and stops where the two searches meet. Each side only has to cover about half the
+        distance, which means far fewer tiles in open areas.
+
         The algorithm explores all possible paths. As above, paths that cross room interiors are considered invalid.
+
+        Like all routers (see ROUTERS below), it returns the path (or None) and the number of expanded nodes.
         """
 
-        obstacles = set()
+        if bidirectional is None:
+            distance = abs(door1[0] - door2[0]) + abs(door1[1] - door2[1])
+            bidirectional = distance >= BFS_BIDIRECTIONAL_DISTANCE
 
-        for room in all_rooms:                      # collect all room positions in a set
-            for y in range(room.y, room.y + room.height):
-                for x in range(room.x, room.x + room.width):
-                    # Allow door positions in room1 and room2
-                    if (room == room1 or room == room2) and ((x, y) == door1 or (x, y) == door2):
-                        continue
-                    obstacles.add((x, y))
+        with obstacles.opened(door1, door2) as (start, target):    # open up the two doors
+            if bidirectional:
+                indices, expanded = Corridor.bidirectional_search(start, target, obstacles)
+            else:
+                indices, expanded = Corridor.breadth_first_search(start, target, obstacles)
+
+        return obstacles.to_path(indices), expanded             # None if there was no chance building this path
+
+    @staticmethod
+    def breadth_first_search(start, target, obstacles):
+        """
+        Plain BFS from start to target on tile indices.
+        Returns the indices of the path (start first) or None, and the number of expanded nodes.
+        """
+
+        search = obstacles.new_search()
+        parent, seen = obstacles.parent[0], obstacles.seen[0]
 
-        queue = deque()                             # init BFS queue
-        queue.append((door1, [door1]))              # start BFS from door1: push coordinates and list of path to queue
-        visited = {door1}                           # initialize a set of visited nodes with door1 coordinates
+        queue = deque([start])                                  # init BFS queue with start
+        seen[start], parent[start] = search, -1
+        expanded = 0
 
         while queue:
-            (x, y), path = queue.popleft()          # pop the next node to process from the queue's left side
-            if (x, y) == door2:                     # check: target reached? if yes, return successfully
-                return path
+            index = queue.popleft()                             # pop the next node to process from the queue's left side
+            expanded += 1
+            if index == target:                                 # check: target reached? if yes, return successfully
+                path = obstacles.trace(target)
+                path.reverse()
+                return path, expanded
 
-            # Investigate the four neighbors to the current position: left, right, down and up
-            for dx, dy in [(1, 0), (-1, 0), (0, 1), (0, -1)]:
-                nx, ny = x + dx, y + dy             # new x and y coordinates
-                # Check if new coordinates are (1) within the level boundaries,
-                #                              (2) have not yet been visited, and
-                #                              (3) are no obstacle fields (eg, parts of any rooms)
-                if (0 <= nx < LEVEL_WIDTH and 0 <= ny < LEVEL_HEIGHT and
-                        (nx, ny) not in visited and (nx, ny) not in obstacles):
-                    # If all this is true, then add the new field to the set of visited coordinates,
-                    # then push new coordinates and the updated path to the queue
-                    visited.add((nx, ny))
-                    queue.append(((nx, ny), path + [(nx, ny)]))
+            for neighbor in obstacles.neighbors(index):         # inside the level and no obstacle
+                if seen[neighbor] != search:                    # not yet visited in this search
+                    seen[neighbor], parent[neighbor] = search, index
+                    queue.append(neighbor)
 
-        return None                                 # no chance building this path
+        return None, expanded
 
     @staticmethod
-    def get_corridor_path(door1, door2, room1, room2, all_rooms):
+    def bidirectional_search(start, target, obstacles):
+        """
+        BFS from both ends. The smaller frontier is expanded by one complete level at a time, and the searches meet
+        as soon as one side reaches a tile that the other side has already seen. All tiles of a frontier have the same
+        distance from their door, so the first meeting point is as good as any other, and the path is exactly as short
+        as with the plain BFS.
         """
-        This is the path construction function. It does nothing by itself. :)
 
-        First,         it tries to find a valid L-shaped corridor path between door1 and door2 via
-                       get_corridor_candidate_path in "hv" mode. If this succeeds, the corridor is returned.
-        Alternatively, it tries to find a valid L-shaped corridor path between door1 and door2 via the same function,
-                       but in "vh" mode. If this succeeds, the corridor is returned.
-        Finally,       it tries to find a corridor path between door1 and door2 via BFS. If this succeeds, the BFS corridor
-                       is returned.
+        if start == target:
+            return [start], 0
 
-        If nothing works, None is returned. (I thought about returning the hv_corridor instead to have at least something,
-        but returning a bad corridor makes no sense.)
-        """
+        search    = obstacles.new_search()
+        frontiers = [[start], [target]]
+        expanded  = 0
 
-        hv_corridor = Corridor.get_corridor_candidate_path(door1, door2, order="hv")
-        if Corridor.is_valid_corridor(hv_corridor, all_rooms):
-            if DEBUG_MODE["corridor_generation"]:
-                print(f"!! I just built a HV mode corridor between {door1} and {door2}!")
-            return hv_corridor
+        for direction, index in enumerate((start, target)):
+            obstacles.seen[direction][index]   = search
+            obstacles.parent[direction][index] = -1
 
-        fallback = Corridor.get_corridor_candidate_path(door1, door2, order="vh")
-        if Corridor.is_valid_corridor(fallback, all_rooms):
-            if DEBUG_MODE["corridor_generation"]:
-                print(f"!! I just built a VH mode corridor between {door1} and {door2}!")
-            return fallback
+        while frontiers[0] and frontiers[1]:
+            side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1
+            seen, parent = obstacles.seen[side], obstacles.parent[side]
+            other_seen   = obstacles.seen[1 - side]
 
-        fallback = Corridor.bfs_path(door1, door2, room1, room2, all_rooms)
-        if fallback:
-            if DEBUG_MODE["corridor_generation"]:
-                print(f"!! I just built a BFS corridor between {door1} and {door2}!")
-            return fallback
+            next_frontier = []
+            for index in frontiers[side]:
+                expanded += 1
+                for neighbor in obstacles.neighbors(index):
+                    if other_seen[neighbor] == search:          # the two searches meet
+                        if side == 1:                           # always build the path from start to target
+                            index, neighbor = neighbor, index
+                        path = obstacles.trace(index, 0)
+                        path.reverse()
+                        return path + obstacles.trace(neighbor, 1), expanded
 
-        return None
+                    if seen[neighbor] != search:
+                        seen[neighbor], parent[neighbor] = search, index
+                        next_frontier.append(neighbor)
+
+            frontiers[side] = next_frontier
+
+        return None, expanded
+
+    @staticmethod
+    def astar_path(door1, door2, obstacles):
+        """
+        A* search (https://en.wikipedia.org/wiki/A*_search_algorithm) as an alternative to the BFS router.
+
+        BFS spreads out evenly in all directions. A* always expands the open tile with the lowest
+        "steps so far + estimated steps to go", and the estimate is the Manhattan distance to door2. Corridors only
+        move in four directions, so the Manhattan distance never overestimates, and the path is as short as the BFS
+        path. But in open rock, A* heads straight for the target and expands far fewer tiles.
+        """
+
+        with obstacles.opened(door1, door2) as (start, target):
+            indices, expanded = Corridor.a_star_search(start, target, obstacles)
+
+        return obstacles.to_path(indices), expanded
+
+    @staticmethod
+    def a_star_search(start, target, obstacles):
+        """
+        A* on tile indices with a binary heap as the open list. Ties between equal estimates go to the tile that is
+        further from the start (larger cost), which digs on towards the target instead of widening the search.
+        Returns the indices of the path (start first) or None, and the number of expanded nodes.
+        """
+
+        search = obstacles.new_search()
+        width  = obstacles.width
+        parent, seen, closed, cost = obstacles.parent[0], obstacles.seen[0], obstacles.seen[1], obstacles.cost
+        target_x, target_y = target % width, target // width
+
+        def estimate(index):
+            return abs(index % width - target_x) + abs(index // width - target_y)
+
+        seen[start], parent[start], cost[start] = search, -1, 0
+        heap     = [(estimate(start), 0, start)]                # (estimate, -cost, tile index)
+        expanded = 0
+
+        while heap:
+            _, negative_cost, index = heappop(heap)
+            if closed[index] == search:                         # an outdated heap entry, tile is already done
+                continue
+            closed[index] = search
+            expanded += 1
+
+            if index == target:
+                path = obstacles.trace(target)
+                path.reverse()
+                return path, expanded
+
+            new_cost = 1 - negative_cost
+            for neighbor in obstacles.neighbors(index):
+                if seen[neighbor] != search or new_cost < cost[neighbor]:
+                    seen[neighbor], parent[neighbor], cost[neighbor] = search, index, new_cost
+                    heappush(heap, (new_cost + estimate(neighbor), -new_cost, neighbor))
+
+        return None, expanded
+
+    @staticmethod
+    def jps_path(door1, door2, obstacles):
+        """
+        Jump point search (Harabor and Grastien, 2011), adapted to corridors that only move in four directions.
+
+        It is A* again, but it does not put every tile onto the heap. A corridor can run through open rock in
+        many equally short ways, and JPS only follows one of them: it prefers turning from horizontal to vertical as
+        early as possible. Straight runs are then followed without stopping ("jumps") until they hit something
+        interesting, and only these jump points are expanded:
+        - a horizontal run stops at a tile where a vertical turn becomes possible that was blocked one tile earlier,
+          and in the column of door2 (where it may turn towards door2),
+        - a vertical run stops at a tile from which a horizontal run finds a jump point,
+        - both stop at door2.
+        A vertical run asks for a horizontal run on every tile. The first version really ran them, along the whole row
+        to the next wall, which made one vertical run cost up to the whole map on large open levels. Now a horizontal
+        run is a binary search in the stops of its row (ObstacleMap.row_stops), which are found once per dungeon.
+        The heuristic is the Manhattan distance, as for A*, and the path is as short as the BFS path.
+        """
+
+        with obstacles.opened(door1, door2) as (start, target):
+            jump_points, expanded = Corridor.jump_point_search(start, target, obstacles)
+
+        if jump_points is None:
+            return None, expanded
+
+        path = [(jump_points[0] % obstacles.width, jump_points[0] // obstacles.width)]
+        for index in jump_points[1:]:                           # fill in the straight lines between the jump points
+            x, y   = path[-1]
+            tx, ty = index % obstacles.width, index // obstacles.width
+            dx, dy = (tx > x) - (tx < x), (ty > y) - (ty < y)
+            while (x, y) != (tx, ty):
+                x, y = x + dx, y + dy
+                path.append((x, y))
+
+        return path, expanded
+
+    @staticmethod
+    def jump_point_search(start, target, obstacles):
+        """
+        The search part of jps_path. Returns the jump points of the path (start first) or None, and the number of
+        expanded nodes: the jump points, plus every tile a vertical run stepped on and every horizontal jump (a lookup
+        in ObstacleMap.row_stops), so the number stands for the work done and can be compared with the other routers.
+        """
+
+        search = obstacles.new_search()
+        width, height, blocked = obstacles.width, obstacles.height, obstacles.blocked
+        parent, seen, closed, cost = obstacles.parent[0], obstacles.seen[0], obstacles.seen[1], obstacles.cost
+        target_x, target_y = target % width, target // width
+
+        scanned = 0                                             # work done by the jumps, for the expanded nodes
+
+        def is_open(x, y):
+            return 0 <= x < width and 0 <= y < height and not blocked[y * width + x]
+
+        def jump_horizontally(x, y, dx):
+            """
+            Jumps from x,y in direction dx and returns the index of the next jump point, or -1 at a dead end.
+            One lookup in the row's stops instead of running along the row tile by tile.
+            """
+
+            nonlocal scanned
+            scanned += 1
+
+            if not 0 <= x + dx < width:
+                return -1
+            index = y * width + x + dx
+            if index == target:
+                return index
+            if blocked[index]:
+                return -1                                       # the next tile is blocked already
+
+            right, left = obstacles.row_stops(y)
+            stop = right[bisect_right(right, x)] if dx > 0 else left[bisect_left(left, x) - 1]
+
+            if 0 < (target_x - x) * dx < (stop - x) * dx:       # passing the column of door2 on the way
+                return y * width + target_x
+            index = y * width + stop
+            if 0 <= stop < width and (index == target or not blocked[index] and index != start):
+                return index                                    # a forced neighbor (or door2 in a wall)
+
+            return -1                                           # a wall
+
+        def jump_vertically(x, y, dy):
+            """
+            Runs from x,y in direction dy, tile by tile, and returns the index of the next jump point, or -1.
+            The run stops where a horizontal jump finds a jump point.
+            """
+
+            nonlocal scanned
+            while True:
+                y += dy
+                scanned += 1
+                if not is_open(x, y):
+                    return -1
+                if x == target_x and y == target_y:
+                    return y * width + x
+                if jump_horizontally(x, y, 1) != -1 or jump_horizontally(x, y, -1) != -1:
+                    return y * width + x
+
+        seen[start], parent[start], cost[start] = search, -1, 0
+        heap     = [(abs(start % width - target_x) + abs(start // width - target_y), 0, start)]
+        expanded = 0
+
+        while heap:
+            _, negative_cost, index = heappop(heap)
+            if closed[index] == search:
+                continue
+            closed[index] = search
+            expanded += 1
+
+            if index == target:
+                path = obstacles.trace(target)
+                path.reverse()
+                return path, expanded + scanned
+
+            x, y = index % width, index // width
+            if parent[index] == -1:                             # the start tile may go anywhere
+                directions = [(1, 0), (-1, 0), (0, 1), (0, -1)]
+            else:
+                dx = (x > parent[index] % width) - (x < parent[index] % width)
+                dy = (y > parent[index] // width) - (y < parent[index] // width)
+                if dy == 0:                                     # arrived horizontally: go on, or turn where forced
+                    directions = [(dx, 0)] + [(0, side) for side in (-1, 1)
+                                              if x == target_x or not is_open(x - dx, y + side)]
+                else:                                           # arrived vertically: go on, or turn either way
+                    directions = [(0, dy), (1, 0), (-1, 0)]
+
+            for dx, dy in directions:
+                jump_point = jump_horizontally(x, y, dx) if dy == 0 else jump_vertically(x, y, dy)
+                if jump_point == -1 or closed[jump_point] == search:
+                    continue
+
+                new_cost = cost[index] + abs(jump_point % width - x) + abs(jump_point // width - y)
+                if seen[jump_point] != search or new_cost < cost[jump_point]:
+                    seen[jump_point], parent[jump_point], cost[jump_point] = search, index, new_cost
+                    estimate = abs(jump_point % width - target_x) + abs(jump_point // width - target_y)
+                    heappush(heap, (new_cost + estimate, -new_cost, jump_point))
+
+        return None, expanded + scanned
+
+    @staticmethod
+    def get_router(router=None):
+        """
+        Returns the router function for a name from ROUTERS. Any function with the same signature as
+        Corridor.bfs_path (door1, door2, obstacles -> path, expanded nodes) can be passed in directly, too.
+        None means the CORRIDOR_ROUTER setting.
+        """
+
+        if router is None:
+            router = CORRIDOR_ROUTER
+        if callable(router):
+            return router
+
+        return ROUTERS[router]
+
+    @staticmethod
+    def get_corridor_path(door1, door2, obstacles, router=None, instrumentation=None):
+        """
+        This is the path construction function. It does nothing by itself. :)
+
+        First,         it tries to find a valid L-shaped corridor path between door1 and door2 via
+                       get_corridor_candidate_path in "hv" mode. If this succeeds, the corridor is returned.
+        Alternatively, it tries to find a valid L-shaped corridor path between door1 and door2 via the same function,
+                       but in "vh" mode. If this succeeds, the corridor is returned.
+        Finally,       it asks a router to find a corridor path between door1 and door2. This is BFS by default, but
+                       the router can be chosen per call (a name from ROUTERS or a function, see get_router).
+
+        The result is a Route: the path, how it was found, and how many nodes the router expanded.
+        With instrumentation (a StageTimer), the router's time is counted as "routing" (the caller decides what comes
+        after that).
+        If nothing works, the path is None. (I thought about returning the hv_corridor instead to have at least
+        something, but returning a bad corridor makes no sense.)
+        """
+
+        hv_corridor = Corridor.get_corridor_candidate_path(door1, door2, order="hv")
+        if Corridor.is_valid_corridor(hv_corridor, obstacles):
+            if DEBUG_MODE["corridor_generation"]:
+                print(f"!! I just built a HV mode corridor between {door1} and {door2}!")
+            return Route(hv_corridor, "hv", 0)
+
+        fallback = Corridor.get_corridor_candidate_path(door1, door2, order="vh")
+        if Corridor.is_valid_corridor(fallback, obstacles):
+            if DEBUG_MODE["corridor_generation"]:
+                print(f"!! I just built a VH mode corridor between {door1} and {door2}!")
+            return Route(fallback, "vh", 0)
+
+        if instrumentation:
+            instrumentation.start("routing")
+        route_function = Corridor.get_router(router)
+        mode = router if isinstance(router, str) else (CORRIDOR_ROUTER if router is None else route_function.__name__)
+
+        fallback, expanded = route_function(door1, door2, obstacles)
+        if fallback:
+            if DEBUG_MODE["corridor_generation"]:
+                print(f"!! I just built a {mode} corridor between {door1} and {door2}!")
+
+        return Route(fallback, mode, expanded)
+
+    @staticmethod
+    def draw_corridors_on_map(corridors, dungeon_map):
+        """
+        Draws all corridors on the map: first the tiles of all paths in one pass, then all doors in a second pass.
+        Paths start and end on their doors, so the doors have to come last.
+        """
+
+        dungeon_map.set_many(chain.from_iterable(corridor.path for corridor in corridors), Tile.CORRIDOR)
+        dungeon_map.set_many([door for corridor in corridors for door in (corridor.door1, corridor.door2)], Tile.DOOR)
+
+    @staticmethod
+    def connection_key(room_id1, room_id2):
+        """
+        One integer for an unordered pair of room IDs: the smaller ID in the high bits, the larger in the low 32 bits.
+        This used to be frozenset({room_id1, room_id2}), which means a new set object for every pair looked at.
+        """
+
+        if room_id1 > room_id2:
+            room_id1, room_id2 = room_id2, room_id1
+
+        return room_id1 << 32 | room_id2
+
+    @staticmethod
+    def nearby_room_pairs(rooms, distance):
+        """
+        Yields the index pairs (i, j), i < j, of all rooms whose centers are at most distance apart (Manhattan
+        distance), in the same order as two nested loops over all pairs would. Rooms further apart are skipped
+        without ever looking at them.
+
+        For that, the room centers are sorted into a grid of distance x distance cells. Two centers that are close
+        enough must be in the same cell or in neighboring cells, so every room only looks at 3 x 3 cells instead of
+        at all other rooms.
+        """
+
+        size    = max(distance, 1)
+        centers = [room.center for room in rooms]               # Room.center is a property, computed on every access
+        cells   = {}
+        for index, (center_x, center_y) in enumerate(centers):
+            cells.setdefault((center_x // size, center_y // size), []).append(index)
+
+        for i, (center_x, center_y) in enumerate(centers):
+            cell_x, cell_y = center_x // size, center_y // size
+            candidates = [j
+                          for dx in (-1, 0, 1) for dy in (-1, 0, 1)
+                          for j in cells.get((cell_x + dx, cell_y + dy), ())
+                          if j > i and abs(centers[j][0] - center_x) + abs(centers[j][1] - center_y) <= distance]
+            candidates.sort()                           # keeps the order of the random decisions below
+
+            for j in candidates:
+                yield i, j
+
+    @staticmethod
+    def add_extra_corridors(rooms, existing_connections, obstacles, rng=random, router=None, config=None,
+                            instrumentation=None):
+        """
+        This is where I officially went nuts: This function tries to add even more corridors between nearby rooms
+        in order to create more labyrinth-like dungeon maps. The probability of adding extra corridors is randomized,
+        because why not? ;)
+
+        How it works:
+        - Iterate all room pairs that are close enough (Manhattan distance <= 25 by default, see nearby_room_pairs).
+        - Skip pairs that are already connected.
+        - With a probability of 25% (by default), attempt to create an extra connection:
+          - Determine door locations for both rooms.
+          - Use Corridor.get_corridor_path() to find a corridor (hv mode, then vh mode, and finally the router).
+          - If path is valid, store the corridor. (It is drawn on the map with all others, see draw_corridors_on_map.)
+
+        Distance, probability and router come from config (and router overrides config.router if given).
+        instrumentation (an Instrumentation) counts the tries and the corridors.
+        """
+
+        if config is None:
+            config = GeneratorConfig()
+        if router is None:
+            router = config.router
+
+        extra_corridors = []
+
+        for i, j in Corridor.nearby_room_pairs(rooms, config.extra_corridor_distance):   # iterate close room pairs
+            room_a = rooms[i]
+            room_b = rooms[j]
+            connection_key = Corridor.connection_key(room_a.id, room_b.id)
+            if connection_key in existing_connections:                  # are the rooms already connected?
+                continue
+
+            # Randomly decide to create an extra connection with 25% probability
+            if rng.random() < config.extra_corridor_probability:        # 25% probability by default
+                door_a = Door.choose_door(room_a, room_b, rng)
+                door_b = Door.choose_door(room_b, room_a, rng)
+
+                path, mode_used, expanded = Corridor.get_corridor_path(door_a, door_b, obstacles, router)
+                if instrumentation:
+                    instrumentation.count("extra_corridors_tried", rooms=(room_a.id, room_b.id))
+                    instrumentation.corridor(mode_used, path, expanded)
+
+                if path:
+                    if DEBUG_MODE["extra_corridor_generation"]:
+                        print(f"## Whoa, I just built an extra corridor in {mode_used} mode between {room_a} and {room_b}!")
+                    extra_corridors.append(Corridor(room_a, room_b, door_a, door_b, path, mode_used, expanded))
+                    existing_connections.add(connection_key)
+                    if instrumentation:
+                        instrumentation.count("extra_corridors_accepted", rooms=(room_a.id, room_b.id))
+
+        return extra_corridors
+
+
+class Route(NamedTuple):
+    """
+    The result of Corridor.get_corridor_path.
+    """
+
+    path    : Optional[List[Tuple[int, int]]]       # None if no corridor could be found
+    mode    : str                                   # "hv", "vh", or the router name
+    expanded: int                                   # nodes expanded by the router (0 for L-shaped corridors)
+
+
+# The corridor routers to choose from, by name. They all take (door1, door2, obstacles) and return the path
+# (or None) plus the number of expanded nodes.
+ROUTERS = {
+    "bfs"  : Corridor.bfs_path,
+    "astar": Corridor.astar_path,
+    "jps"  : Corridor.jps_path
+}
+
+
+@dataclass(frozen=True)
+class LevelRecord:
+    """
+    A compact summary of a generated level, small enough to be sent back from a worker process.
+    Pickling a complete Dungeon would drag along all Room and Corridor objects and every path tuple;
+    this is just a few tuples plus the tile bytes.
+
+    rooms    : (x, y, width, height) per room, the position in the tuple is the room ID
+    corridors: (room ID, room ID, path length) per corridor
+    stats    : Instrumentation.export() of the level, if it was generated with instrumentation
+    """
+
+    seed     : int
+    width    : int
+    height   : int
+    tiles    : bytes
+    rooms    : Tuple[Tuple[int, int, int, int], ...]
+    corridors: Tuple[Tuple[int, int, int], ...]
+    exit     : Tuple[int, int]
+    stats    : Optional[dict] = None
+
+
+class FogOfWar:
+    """
+    What the player knows about a level, as bitsets: one Python integer per map row, where bit x stands for tile x.
+    - explored: every corridor and door tile the player has ever seen. This is what the renderer shows.
+    - rooms   : one bit per room ID, for the rooms the player has entered.
+
+    A list of lists of bools costs 8 bytes per tile plus the list overhead. Here, a 80 x 25 level needs 25 small
+    integers, and the whole state serializes into a few dozen bytes (see to_bytes).
+    """
+
+    __slots__ = ("width", "height", "explored", "rooms")
+
+    HEADER = struct.Struct("<III")                  # width, height, length of the room bits in bytes
+
+    def __init__(self, width, height):
+        """
+        Create a fog for a width x height level, with nothing explored yet.
+        """
+
+        self.width    = width
+        self.height   = height
+        self.explored = [0] * height
+        self.rooms    = 0
+
+    def is_explored(self, x, y):
+        """
+        Checks if the tile at x,y has been seen.
+        """
+
+        return (self.explored[y] >> x) & 1 == 1
+
+    def explore(self, x, y):
+        """
+        Marks the tile at x,y as seen. Returns True if it was unknown so far.
+        """
+
+        bit = 1 << x
+        if self.explored[y] & bit:
+            return False
+
+        self.explored[y] |= bit
+        return True
+
+    def room_explored(self, room_id):
+        """
+        Checks if the room with this ID has been entered.
+        """
+
+        return (self.rooms >> room_id) & 1 == 1
+
+    def explore_room(self, room_id):
+        """
+        Marks a room as entered. Returns True if it was unknown so far.
+        """
+
+        bit = 1 << room_id
+        if self.rooms & bit:
+            return False
+
+        self.rooms |= bit
+        return True
+
+    def to_bytes(self):
+        """
+        Packs the explored tiles and rooms into bytes: a small header, then every row as a fixed number of bytes,
+        then the room bits, all compressed with zlib (unexplored rows are just zero bytes and compress to nothing).
+        """
+
+        row_size   = (self.width + 7) // 8
+        room_size  = (self.rooms.bit_length() + 7) // 8
+        rows       = b"".join(row.to_bytes(row_size, "little") for row in self.explored)
+        room_bits  = self.rooms.to_bytes(room_size, "little")
+
+        return self.HEADER.pack(self.width, self.height, room_size) + zlib.compress(rows + room_bits)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        Restores a fog from to_bytes().
+        """
+
+        width, height, room_size = cls.HEADER.unpack_from(data)
+        payload  = zlib.decompress(data[cls.HEADER.size:])
+        row_size = (width + 7) // 8
+
+        fog = cls(width, height)
+        fog.explored = [int.from_bytes(payload[start:start + row_size], "little")
+                        for start in range(0, row_size * height, row_size)]
+        fog.rooms    = int.from_bytes(payload[row_size * height:row_size * height + room_size], "little")
+
+        return fog
+
+
+class FieldOfView:
+    """
+    Field of view: which tiles can be seen from a position, within a radius, with walls and rock blocking the view
+    (Tile.OPAQUE). This is symmetric shadowcasting (https://www.albertford.com/shadowcasting/): the area around the
+    viewer is split into four quadrants, and each quadrant is scanned row by row, moving away from the viewer.
+    Every row is a range of columns between two slopes; an opaque tile narrows the range for the rows behind it,
+    and a gap between two opaque tiles starts a new scan (that's the recursion) with its own range.
+
+    "Symmetric" means: if A can see B, B can see A. Floor tiles are only visible if their center is inside the
+    scanned range, which is what makes this work.
+
+    The slopes are fractions like (2 * column - 1) / (2 * depth). I keep them as (numerator, denominator) pairs of
+    integers instead of Fraction objects, which makes all comparisons exact and a lot faster.
+
+    The results are cached per (x, y, radius). The terrain doesn't change while playing, so the cache only has to
+    be thrown away when the map's version changes.
+    """
+
+    QUADRANTS = ((0, -1, 1, 0), (0, 1, 1, 0), (-1, 0, 0, 1), (1, 0, 0, 1))     # (dx per depth, dy per depth,
+                                                                                # dx per column, dy per column)
+
+    def __init__(self, tile_map, capacity=FOV_CACHE_SIZE):
+        """
+        Create an empty cache for a map.
+        """
+
+        self.map      = tile_map
+        self.capacity = capacity
+        self.cache    = OrderedDict()           # (x, y, radius) -> frozenset of visible (x, y), least recently used first
+        self.version  = tile_map.version
+        self.hits     = 0
+        self.misses   = 0
+
+    def compute(self, x, y, radius=FOV_RADIUS):
+        """
+        Returns the set of tiles visible from x,y, from the cache if possible.
+        """
+
+        if self.map.version != self.version:    # the map has changed, every cached view may be wrong
+            self.cache.clear()
+            self.version = self.map.version
+
+        key     = (x, y, radius)
+        visible = self.cache.get(key)
+        if visible is not None:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return visible
+
+        self.misses += 1
+        visible = FieldOfView.shadowcast(self.map, x, y, radius)
+
+        self.cache[key] = visible
+        if len(self.cache) > self.capacity:
+            self.cache.popitem(last=False)
+
+        return visible
+
+    @staticmethod
+    def shadowcast(tile_map, origin_x, origin_y, radius):
+        """
+        The actual shadowcasting, without any cache. Tiles outside the map count as opaque and are never visible.
+        Tiles further away than radius (Euclidean distance) are not visible either.
+        """
+
+        width, height, tiles, opaque = tile_map.width, tile_map.height, tile_map.tiles, Tile.OPAQUE
+        radius_squared = radius * radius
+        visible = {(origin_x, origin_y)}
+
+        for depth_x, depth_y, column_x, column_y in FieldOfView.QUADRANTS:
+
+            def is_opaque(depth, column):
+                x = origin_x + depth * depth_x + column * column_x
+                y = origin_y + depth * depth_y + column * column_y
+                return not (0 <= x < width and 0 <= y < height) or opaque[tiles[y * width + x]] == 1
+
+            def reveal(depth, column):
+                x = origin_x + depth * depth_x + column * column_x
+                y = origin_y + depth * depth_y + column * column_y
+                if 0 <= x < width and 0 <= y < height and depth * depth + column * column <= radius_squared:
+                    visible.add((x, y))
+
+            def scan(depth, start, end):
+                """
+                Scans one row. start and end are the slopes (numerator, denominator) of the visible range.
+                """
+
+                if depth > radius:
+                    return
+
+                start_num, start_den = start
+                end_num, end_den     = end
+                first_column = (2 * depth * start_num + start_den) // (2 * start_den)   # depth * start, ties up
+                last_column  = -((end_den - 2 * depth * end_num) // (2 * end_den))     # depth * end, ties down
+
+                previous = None                                 # None: no tile yet, else True for opaque
+                for column in range(first_column, last_column + 1):
+                    wall = is_opaque(depth, column)
+                    if wall or (column * start_den >= depth * start_num and column * end_den <= depth * end_num):
+                        reveal(depth, column)                   # walls always, floors only if symmetric
+                    if previous is True and not wall:           # a gap after a wall: the range starts here
+                        start = (2 * column - 1, 2 * depth)
+                    if previous is False and wall:              # a wall after a gap: scan behind the gap
+                        scan(depth + 1, start, (2 * column - 1, 2 * depth))
+                    previous = wall
+
+                if previous is False:                           # the row ended in a gap, go on behind it
+                    scan(depth + 1, start, end)
+
+            scan(1, (-1, 1), (1, 1))
+
+        return frozenset(visible)
+
+
+class ConnectivityReport(NamedTuple):
+    """
+    The result of Connectivity.validate.
+    """
+
+    unreachable_rooms: Tuple[int, ...]                      # room IDs
+    unreachable_doors: Tuple[Tuple[int, int], ...]
+    exit_reachable   : bool
+    components       : Tuple[Tuple[int, Tuple[int, int]], ...]  # (size, first tile) of every walkable area
+                                                                # that cannot be reached from the start
+    @property
+    def connected(self):
+        return self.exit_reachable and not (self.unreachable_rooms or self.unreachable_doors or self.components)
+
+
+@namespace
+class Connectivity:
+    """
+    Checks that a level is in one piece: one flood fill over the walkable tiles from the player's start, then every
+    room, door and the exit must have been reached. Whatever walkable tiles are left over are grouped into
+    components, so a broken level says where it is broken.
+
+    The flood fill works on a copy of the walkable flags with one extra (unwalkable) column per row and an extra
+    row at the top and bottom. Neighbors are then just index +-1 and +-stride, without any bounds checks, because
+    a step off the map always lands on padding.
+    """
+
+    @staticmethod
+    def walkable_grid(tile_map):
+        """
+        The padded walkable flags (one byte per tile, 1 = walkable) and the stride of a padded row.
+        """
+
+        width, stride = tile_map.width, tile_map.width + 1
+        walkable = tile_map.tiles.translate(Tile.WALKABLE)              # bytes.translate: no Python loop per tile
+        rows     = b"\x00".join(walkable[y * width:(y + 1) * width] for y in range(tile_map.height))
+
+        return bytearray(bytes(stride + 1) + rows + bytes(stride + 1)), stride
+
+    @staticmethod
+    def flood(grid, stride, start):
+        """
+        Marks every walkable tile reachable from the padded index start with 2 and returns the number of tiles.
+        """
+
+        if grid[start] != 1:
+            return 0
+
+        grid[start] = 2
+        stack, size = [start], 1
+        while stack:
+            index = stack.pop()
+            for neighbor in (index - stride, index + stride, index - 1, index + 1):
+                if grid[neighbor] == 1:
+                    grid[neighbor] = 2
+                    stack.append(neighbor)
+                    size += 1
+
+        return size
+
+    @staticmethod
+    def validate(dungeon, start=None):
+        """
+        Validates a generated level. start is the player's start, by default the center of the first room (where
+        Player.initialize puts the player).
+        """
+
+        grid, stride = Connectivity.walkable_grid(dungeon.map)
+
+        def padded(x, y):
+            return (y + 1) * stride + x + 1
+
+        x, y = start if start is not None else dungeon.rooms[0].center
+        Connectivity.flood(grid, stride, padded(x, y))
+
+        unreachable_rooms = tuple(room.id for room in dungeon.rooms if grid[padded(*room.center)] != 2)
+        unreachable_doors = tuple(door for doors in dungeon.room_doors for door in doors if grid[padded(*door)] != 2)
+        exit_reachable    = grid[padded(*dungeon.exit)] == 2
+
+        components = []
+        index = grid.find(1)
+        while index != -1:                                              # every tile left over starts a new component
+            size = Connectivity.flood(grid, stride, index)
+            components.append((size, (index % stride - 1, index // stride - 1)))
+            index = grid.find(1, index)
+
+        return ConnectivityReport(unreachable_rooms, unreachable_doors, exit_reachable, tuple(components))
+
+
+class StageTimer:
+    """
+    Adds up the time (perf_counter_ns) spent in each stage of Dungeon.generate(). start() ends the running stage
+    and starts the next one, so generate() only needs one call at every point where the work changes. The stages
+    take turns: the corridor loop goes back and forth between L-paths, routing, and rasterization for every corridor.
+
+    rooms           : room placement, room grid, obstacle map, exit
+    mst             : picking the corridors of the minimum spanning tree (and their doors)
+    l_paths         : trying hv and vh L-shaped corridors
+    routing         : the router (BFS, A*, JPS) for corridors that are no L-shape
+    extra_corridors : picking, routing, and checking extra corridors
+    rasterize       : writing rooms, corridors (all of them), and doors into the tile map, and indexing the doors
+    """
+
+    STAGES = ("rooms", "mst", "l_paths", "routing", "extra_corridors", "rasterize")
+
+    __slots__ = ("times", "stage", "started")
+
+    def __init__(self):
+        self.times   = dict.fromkeys(StageTimer.STAGES, 0)
+        self.stage   = None
+        self.started = 0
+
+    def start(self, stage):
+        """
+        Ends the running stage (if any) and starts stage.
+        """
+
+        now = time.perf_counter_ns()
+        if self.stage is not None:
+            self.times[self.stage] += now - self.started
+        self.stage, self.started = stage, now
+
+    def stop(self):
+        """
+        Ends the running stage.
+        """
+
+        self.start(None)
+
+    def count(self, counter, amount=1, **details):
+        """
+        A StageTimer only times. Instrumentation counts as well.
+        """
+
+    def corridor(self, mode, path, expanded):
+        """
+        See count().
+        """
+
+
+class Instrumentation(StageTimer):
+    """
+    What happened while one level was generated: the stage times of a StageTimer plus a counter for everything
+    worth counting (see COUNTERS). A slow level usually explains itself with these, like thousands of overlap
+    rejections on a crowded map or a handful of corridors that all needed the router.
+
+    sink, if given, is called as sink(counter, details) for every single count, e.g. to log the positions of the
+    rejected rooms. Without instrumentation on the Dungeon, generate() only pays for the "if instrumentation:" tests.
+    """
+
+    COUNTERS = (
+        "placement_attempts",       # rooms the generator tried to place
+        "overlap_rejections",       # random positions that hit another room (or its buffer)
+        "placement_failures",       # attempts without any free position for the room size
+        "hv_corridors",             # corridors by how they were found
+        "vh_corridors",
+        "routed_corridors",
+        "failed_corridors",         # no path at all
+        "expanded_nodes",           # nodes the router expanded
+        "extra_corridors_tried",
+        "extra_corridors_accepted"
+    )
+
+    __slots__ = ("counters", "sink")
+
+    def __init__(self, sink=None):
+        super().__init__()
+        self.counters = dict.fromkeys(Instrumentation.COUNTERS, 0)
+        self.sink     = sink
+
+    def count(self, counter, amount=1, **details):
+        """
+        Adds amount to a counter and tells the sink about it.
+        """
+
+        self.counters[counter] += amount
+        if self.sink is not None:
+            self.sink(counter, details)
+
+    def corridor(self, mode, path, expanded):
+        """
+        Counts a corridor by how it was found, and the nodes the router expanded for it.
+        """
+
+        if not path:
+            self.count("failed_corridors")
+        elif mode in ("hv", "vh"):
+            self.count(f"{mode}_corridors")
+        else:
+            self.count("routed_corridors")
+        if expanded:
+            self.count("expanded_nodes", expanded)
+
+    def export(self):
+        """
+        Counters and stage times (in µs) as a dictionary, ready for JSON.
+        """
+
+        return {
+            "counters"      : dict(self.counters),
+            "stage_times_us": {stage: elapsed / 1000 for stage, elapsed in self.times.items()}
+        }
+
+
+class Dungeon:
+    def __init__(self, config=None, router=None):
+        """
+        Initialize an empty dungeon.
+        config is the GeneratorConfig for the level (None means the defaults from settings.py). router picks the
+        corridor router (a name from ROUTERS or a function, see Corridor.get_router) and overrides config.router.
+        """
+
+        self.config    = config if config is not None else GeneratorConfig()
+
+        self.map       = None
+        self.rooms     = []
+        self.room_grid = None
+        self.obstacles = None
+        self.corridors = []
+        self.room_doors = []                                    # door tiles in the walls of each room, by room ID
+        self.fog  = None                                        # a FogOfWar, once there is a map
+        self.field_of_view = None                               # a FieldOfView on the map, once there is one
+        self.exit = None
+        self.stairs_up = None                                   # only on the lower floors of a FloorStack
+        self.entities = {}                                      # state of everything that lives here, must be
+                                                                # JSON-compatible (so far only "player": [x, y],
+                                                                # where the player left the floor)
+        self.seed = None
+        self.router = router if router is not None else self.config.router
+        self.expanded_nodes = 0                                 # nodes the router expanded for the whole level
+        self.reveal_log = []                                    # (x, y, width, height) of everything revealed since
+                                                                # the renderer last looked, see DungeonVisualizer
+        self.instrumentation = None                             # a StageTimer or Instrumentation, if generate()
+                                                                # should be timed or counted
+
+    def generate(self, seed=None, rng=None):
+        """
+        Generate a dungeon level:
+        1. initialize the map by filling it with rock tiles
+        2. generate rooms
+        3. connect rooms with corridors
+        4. add extra corridors
+
+        The function returns all info about the dungeon, namely:
+        1. 2D grid of the level layout
+        2. [rooms]
+        3. [corridors]
+
+        All random decisions are drawn from one random.Random instance, so the level is fully determined by the seed:
+        - seed and rng: rng is re-seeded with seed,
+        - seed only   : a new random.Random(seed) is used,
+        - rng only    : rng is used as it is (the caller is responsible for its state),
+        - neither     : a random seed is picked and stored in self.seed, so the level can be recreated later.
+        """
+
+        if seed is None and rng is None:
+            seed = random.getrandbits(SEED_BITS)
+        if rng is None:
+            rng = random.Random()
+        if seed is not None:
+            rng.seed(seed)
+        self.seed = seed
+        instrumentation = self.instrumentation                  # None costs one test per stage, nothing more
+
+        if instrumentation:
+            instrumentation.start("rasterize")
+        self.map = self.let_there_be_rock(self.config)          # create the abyss using both AC & DC
+
+        if instrumentation:
+            instrumentation.start("rooms")
+        # carve rooms into the foundations of the earth
+        self.rooms = Room.generate_rooms(rng, self.config, instrumentation)
+        if instrumentation:
+            instrumentation.start("rasterize")
+        for room in self.rooms:
+            Room.draw_room_on_map(room, self.map)               # ask Elrond for a map
+
+        if instrumentation:
+            instrumentation.start("rooms")
+
+        self.room_grid = RoomGrid(self.map.width, self.map.height, self.rooms)  # and an index to that map
+        self.obstacles = ObstacleMap(self.room_grid)            # dwarves only dig through rock
+
+        exit_room = rng.choice(self.rooms)
+        exit_x = rng.randint(exit_room.x + 1, exit_room.x + exit_room.width - 2)
+        exit_y = rng.randint(exit_room.y + 1, exit_room.y + exit_room.height - 2)
+
+        self.exit = (exit_x, exit_y)
+        self.map.set(exit_x, exit_y, Tile.EXIT)
+
+        if instrumentation:
+            instrumentation.start("mst")
+        corridor_edges = Corridor.connect_rooms_by_mst(self.rooms, rng, self.config)   # let the dwarves dig
+        self.corridors = []
+        existing_connections = set()
+
+        for room_a, room_b, door_a, door_b in corridor_edges:
+            if instrumentation:
+                instrumentation.start("l_paths")
+            path, mode, expanded = Corridor.get_corridor_path(door_a, door_b, self.obstacles, self.router,
+                                                              instrumentation)
+            if instrumentation:
+                instrumentation.corridor(mode, path, expanded)
+                instrumentation.start("mst")
+
+            if not path:                                        # no way through the rock: no corridor, no doors.
+                if DEBUG_MODE["corridor_generation"]:           # The rooms stay unconnected (an extra corridor
+                    print(f"!! No corridor between {room_a} and {room_b}!")    # might still connect them), and
+                continue                                        # Connectivity.validate reports the level
+
+            self.corridors.append(
+                Corridor(room_a, room_b, door_a, door_b, path, mode, expanded)
+            )
+
+            existing_connections.add(Corridor.connection_key(room_a.id, room_b.id))
+
+        # Add extra corridors, but don't dig to deep and beware of Balrogs!
+        if instrumentation:
+            instrumentation.start("extra_corridors")
+        extra_corridors = Corridor.add_extra_corridors(
+            self.rooms, existing_connections, self.obstacles, rng, self.router, self.config, instrumentation
+        )
+        self.corridors.extend(extra_corridors)
+        self.expanded_nodes = sum(corridor.expanded for corridor in self.corridors)
+
+        if instrumentation:
+            instrumentation.start("rasterize")
+        Corridor.draw_corridors_on_map(self.corridors, self.map)   # mark corridors on the map using moon runes,
+                                                                # and doors with Ithildin letters
+        self.index_doors()
+        self.fog        = FogOfWar(self.map.width, self.map.height)
+        self.reveal_log = []
+        self.field_of_view = FieldOfView(self.map)
+        self.obstacles  = None                                  # the dwarves are done, drop their scratch arrays
+        if instrumentation:
+            instrumentation.stop()
+
+    @staticmethod
+    def let_there_be_rock(config):
+        """
+        🪨🤘🎸. (Sorry.)
+        """
+
+        return TileMap(config.width, config.height, Tile.ROCK)
+
+    def to_record(self, seed):
+        """
+        Packs the generated level into a LevelRecord. The seed is only stored, it is needed to reproduce the level.
+        """
+
+        return LevelRecord(
+            seed      = seed,
+            width     = self.map.width,
+            height    = self.map.height,
+            tiles     = bytes(self.map.tiles),
+            rooms     = tuple((room.x, room.y, room.width, room.height) for room in self.rooms),
+            corridors = tuple((corridor.room1.id, corridor.room2.id, len(corridor.path)) for corridor in self.corridors),
+            exit      = self.exit,
+            stats     = self.instrumentation.export() if isinstance(self.instrumentation, Instrumentation) else None
+        )
+
+    def get_room_at(self, x, y):
+        """
+        Finds the room at given coordinates (or returns None).
+        """
+
+        room_id = self.room_grid.room_id_at(x, y)
+
+        return self.rooms[room_id] if room_id != -1 else None
+
+    def walking_distance(self, start, goal):
+        """
+        Number of steps the player needs from start to goal (up, down, left, right over walkable tiles), or None if
+        there is no way. A plain BFS, one frontier per step, on the flat tile indices of the map.
+        """
+
+        tiles, width = self.map.tiles, self.map.width
+        start, goal  = start[1] * width + start[0], goal[1] * width + goal[0]
+        if start == goal:
+            return 0
+
+        seen = bytearray(len(tiles))
+        seen[start] = 1
+        frontier, steps = [start], 0
+
+        while frontier:
+            steps += 1
+            next_frontier = []
+            for index in frontier:
+                x = index % width
+                for neighbor, step_x in ((index - width, x), (index + width, x), (index - 1, x - 1), (index + 1, x + 1)):
+                    if 0 <= step_x < width and 0 <= neighbor < len(tiles) and not seen[neighbor] \
+                            and Tile.WALKABLE[tiles[neighbor]]:
+                        if neighbor == goal:
+                            return steps
+                        seen[neighbor] = 1
+                        next_frontier.append(neighbor)
+            frontier = next_frontier
+
+        return None
+
+    def is_corridor(self, x, y):
+        """
+        Checks if the cell at any given coordinate is part of any corridor.
+        A more complicated solution would be:
+        return any((x, y) in corridor.path for corridor in self.corridors)
+        This might be necessary if this check would be done during the generation process. No idea if this might
+        happen, I just want to remember the line. :)
+        """
+
+        return self.map.get(x, y) == Tile.CORRIDOR
+
+    def print(self):
+        """
+        Prints the dungeon in ASCII mode. Added this just to have a print function within the Dungeon class.
+        """
+
+        Utilities.print_map(self.map)
+
+    def index_doors(self):
+        """
+        Lists the doors in the walls of every room, so revealing a room's doors doesn't mean looking at every tile
+        of the room. Doors only sit in the walls, so I only scan the outline: the top and bottom walls as slices of
+        the map (bytearray.find jumps from door to door), the side walls tile by tile.
+        """
+
+        tiles, width = self.map.tiles, self.map.width
+        self.room_doors = []
+
+        for room in self.rooms:
+            doors = []
+            for y in (room.y, room.y + room.height - 1):                # top and bottom walls
+                start, end = y * width + room.x, y * width + room.x + room.width
+                index = tiles.find(Tile.DOOR, start, end)
+                while index != -1:
+                    doors.append((index - y * width, y))
+                    index = tiles.find(Tile.DOOR, index + 1, end)
+            for x in (room.x, room.x + room.width - 1):                 # left and right walls
+                for y in range(room.y + 1, room.y + room.height - 1):
+                    if tiles[y * width + x] == Tile.DOOR:
+                        doors.append((x, y))
+            self.room_doors.append(doors)
+
+    def update_corridor_visibility(self, player_x, player_y):
+        """
+        Updates the corridor visibility based on the player's current position.
+        The current player position plus eight neighbor cells are revealed, and so are all doors of the current room
+        (from the precomputed room_doors, not by checking every tile of the room).
+        With USE_FIELD_OF_VIEW, every corridor and door tile in the player's field of view is revealed instead of
+        just the neighbors.
+        """
+
+        if USE_FIELD_OF_VIEW:
+            for x, y in self.field_of_view.compute(player_x, player_y, FOV_RADIUS):
+                if self.map.get(x, y) in (Tile.CORRIDOR, Tile.DOOR):
+                    self.reveal_tile(x, y)
+
+        for dy in (-1, 0, 1):                                           # reveal adjacent doors and corridors
+            for dx in (-1, 0, 1):
+                nx, ny = player_x + dx, player_y + dy                   # new x and y
+                if self.map.in_bounds(nx, ny):                          # within boundaries?
+                    if self.map.get(nx, ny) in (Tile.CORRIDOR, Tile.DOOR):  # what kind of tile?
+                        self.reveal_tile(nx, ny)
+
+        player_room = self.get_room_at(player_x, player_y)              # reveal all doors from current room
+        if player_room:
+            for door_x, door_y in self.room_doors[player_room.id]:
+                self.reveal_tile(door_x, door_y)
+
+    def reveal_tile(self, x, y):
+        """
+        Marks a corridor or door tile as explored. Only tiles that were hidden so far go into the reveal log.
+        """
+
+        if self.fog.explore(x, y):
+            self.reveal_log.append((x, y, 1, 1))
+
+    def reveal_room_at(self, x, y):
+        """
+        Marks the room at x,y (if there is one) as explored, and logs it if it was hidden so far.
+        """
+
+        room = self.get_room_at(x, y)                                   # one lookup in the room grid
+        if room and self.fog.explore_room(room.id):
+            self.reveal_log.append((room.x, room.y, room.width, room.height))
+
+
+class LevelCache:
+    """
+    Keeps only the most recently used levels in memory. Everything else is represented by its seed alone:
+    since generation is deterministic, a level that has been evicted is simply generated again when it is needed.
+
+    Levels are keyed by (seed, config fingerprint), because the same seed gives a different level once the
+    generation settings change.
+    """
+
+    def __init__(self, capacity=LEVEL_CACHE_SIZE, config=None):
+        """
+        Create an empty cache that holds at most capacity levels, all generated with config.
+        """
+
+        self.capacity     = capacity
+        self.config       = config if config is not None else GeneratorConfig()
+        self.levels       = OrderedDict()       # least recently used level first
+        self.settings_key = self.config.fingerprint()
+        self.hits         = 0
+        self.misses       = 0
+
+    def get(self, seed):
+        """
+        Returns the level for a seed. It comes from the cache if possible, otherwise it is generated (again).
+        """
+
+        key = (seed, self.settings_key)
+
+        dungeon = self.levels.get(key)
+        if dungeon is not None:
+            self.hits += 1
+            self.levels.move_to_end(key)                # mark as most recently used
+            return dungeon
+
+        self.misses += 1
+        dungeon = Dungeon(self.config)
+        dungeon.generate(seed)
+
+        self.levels[key] = dungeon
+        if len(self.levels) > self.capacity:
+            self.levels.popitem(last=False)             # evict the least recently used level
+
+        return dungeon
+
+    def __contains__(self, seed):
+        return (seed, self.settings_key) in self.levels
+
+    def __len__(self):
+        return len(self.levels)
+
+
+@namespace
+class LevelCodec:
+    """
+    A compact binary format for one level. Everything is little-endian:
+
+    header    : magic b"RLVL", format version, width, height, seed (-1 if unknown), exit x, y,
+                number of rooms, number of corridors
+    rooms     : x, y, width, height per room (the position is the room ID)
+    corridors : room IDs, how the path was found, both doors, and the path as its corner points only. A corridor
+                is made of straight segments, so the tiles between two corners are easy to fill in again.
+    tiles     : two tiles per byte. There are only eight tile types, so each one fits into four bits (a nibble).
+
+    Packing and unpacking the tiles is done with bytes.translate and slice assignments, so there is no Python loop
+    over the tiles at all.
+    """
+
+    MAGIC    = b"RLVL"
+    VERSION  = 1
+    HEADER   = struct.Struct("<4sHHHqHHII")
+    ROOM     = struct.Struct("<HHHH")
+    CORRIDOR = struct.Struct("<IIBHHHHH")       # room1, room2, mode, door1 x, y, door2 x, y, number of corners
+    POINT    = struct.Struct("<HH")
+
+    TILE_CODES = (Tile.ROCK, Tile.FLOOR, Tile.CORRIDOR, Tile.DOOR, Tile.EXIT, Tile.HORIZONTAL_WALL, Tile.VERTICAL_WALL,
+                  Tile.UP_STAIRS)
+    MODES      = ("hv", "vh") + tuple(ROUTERS)  # mode 255 is a router that is not in this list
+
+    # translate tables: tile code -> nibble (as high or low half of a byte), and packed byte -> tile code
+    HIGH_NIBBLE = bytes.maketrans(bytes(TILE_CODES), bytes(range(0, 16 * len(TILE_CODES), 16)))
+    LOW_NIBBLE  = bytes.maketrans(bytes(TILE_CODES), bytes(range(len(TILE_CODES))))
+    LOW_TILE    = (bytes(TILE_CODES) + bytes([Tile.ROCK]) * (16 - len(TILE_CODES))) * 16
+    HIGH_TILE   = b"".join(bytes([code]) * 16 for code in LOW_TILE[:16])
+
+    @staticmethod
+    def corners(path):
+        """
+        Reduces a path to its first tile, the tiles where it changes direction, and its last tile.
+        """
+
+        if not path:
+            return []
+
+        corners = [path[0]]
+        for previous, current, following in zip(path, path[1:], path[2:]):
+            if (current[0] - previous[0], current[1] - previous[1]) != (following[0] - current[0], following[1] - current[1]):
+                corners.append(current)
+        if len(path) > 1:
+            corners.append(path[-1])
+
+        return corners
+
+    @staticmethod
+    def expand(corners):
+        """
+        The opposite of corners(): fills in the straight lines between the corner points.
+        """
+
+        if not corners:
+            return None
+
+        path = [corners[0]]
+        for target_x, target_y in corners[1:]:
+            x, y   = path[-1]
+            dx, dy = (target_x > x) - (target_x < x), (target_y > y) - (target_y < y)
+            while (x, y) != (target_x, target_y):
+                x, y = x + dx, y + dy
+                path.append((x, y))
+
+        return path
+
+    @staticmethod
+    def pack_tiles(tiles):
+        """
+        Packs tile codes into nibbles: the even tiles go into the high halves, the odd tiles into the low halves.
+        """
+
+        if len(tiles) % 2:
+            tiles = tiles + bytes([Tile.ROCK])
+
+        return bytes(map(or_, tiles[0::2].translate(LevelCodec.HIGH_NIBBLE), tiles[1::2].translate(LevelCodec.LOW_NIBBLE)))
+
+    @staticmethod
+    def unpack_tiles(packed, count):
+        """
+        Unpacks count tile codes from nibbles.
+        """
+
+        tiles = bytearray(2 * len(packed))
+        tiles[0::2] = packed.translate(LevelCodec.HIGH_TILE)
+        tiles[1::2] = packed.translate(LevelCodec.LOW_TILE)
+        del tiles[count:]
+
+        return tiles
+
+    @staticmethod
+    def encode(dungeon):
+        """
+        Packs a generated Dungeon into bytes.
+        """
+
+        tile_map = dungeon.map
+        seed     = dungeon.seed if dungeon.seed is not None else -1
+        parts    = [LevelCodec.HEADER.pack(LevelCodec.MAGIC, LevelCodec.VERSION, tile_map.width, tile_map.height, seed,
+                                           *dungeon.exit, len(dungeon.rooms), len(dungeon.corridors))]
+
+        parts.extend(LevelCodec.ROOM.pack(room.x, room.y, room.width, room.height) for room in dungeon.rooms)
+
+        for corridor in dungeon.corridors:
+            corners = LevelCodec.corners(corridor.path)
+            mode    = LevelCodec.MODES.index(corridor.mode) if corridor.mode in LevelCodec.MODES else 255
+            parts.append(LevelCodec.CORRIDOR.pack(corridor.room1.id, corridor.room2.id, mode,
+                                                  *corridor.door1, *corridor.door2, len(corners)))
+            parts.extend(LevelCodec.POINT.pack(*corner) for corner in corners)
+
+        parts.append(LevelCodec.pack_tiles(tile_map.tiles))
+
+        return b"".join(parts)
+
+    @staticmethod
+    def decode(data):
+        """
+        Unpacks bytes from encode() into a Dungeon that is ready to play (map, rooms, corridors, exit, room grid,
+        doors, fog). It has no ObstacleMap, since nothing is dug into a finished level anymore.
+        """
+
+        magic, version, width, height, seed, exit_x, exit_y, room_count, corridor_count = \
+            LevelCodec.HEADER.unpack_from(data)
+        if magic != LevelCodec.MAGIC:
+            raise ValueError("Not a level: wrong magic bytes.")
+        if version != LevelCodec.VERSION:
+            raise ValueError(f"Unsupported level format version {version}, expected {LevelCodec.VERSION}.")
+
+        offset = LevelCodec.HEADER.size
+        rooms  = [Room(*room, room_id) for room_id, room in
+                  enumerate(LevelCodec.ROOM.iter_unpack(data[offset:offset + room_count * LevelCodec.ROOM.size]))]
+        offset += room_count * LevelCodec.ROOM.size
+
+        corridors = []
+        for _ in range(corridor_count):
+            room1, room2, mode, door1_x, door1_y, door2_x, door2_y, corner_count = \
+                LevelCodec.CORRIDOR.unpack_from(data, offset)
+            offset += LevelCodec.CORRIDOR.size
+            corners = list(LevelCodec.POINT.iter_unpack(data[offset:offset + corner_count * LevelCodec.POINT.size]))
+            offset += corner_count * LevelCodec.POINT.size
+
+            corridors.append(Corridor(rooms[room1], rooms[room2], (door1_x, door1_y), (door2_x, door2_y),
+                                      LevelCodec.expand(corners),
+                                      LevelCodec.MODES[mode] if mode < len(LevelCodec.MODES) else "custom"))
+
+        dungeon = Dungeon(GeneratorConfig(width=width, height=height))
+        dungeon.map = TileMap(width, height)
+        dungeon.map.tiles = LevelCodec.unpack_tiles(bytes(data[offset:]), width * height)
+        dungeon.rooms, dungeon.corridors = rooms, corridors
+        dungeon.exit  = (exit_x, exit_y)
+        dungeon.seed  = seed if seed >= 0 else None
+        dungeon.room_grid = RoomGrid(width, height, rooms)
+        stairs = dungeon.map.tiles.find(Tile.UP_STAIRS)
+        dungeon.stairs_up = divmod(stairs, width)[::-1] if stairs != -1 else None
+        dungeon.index_doors()
+        dungeon.fog = FogOfWar(width, height)
+        dungeon.field_of_view = FieldOfView(dungeon.map)
+
+        return dungeon
+
+
+class LevelArchive:
+    """
+    A file with many encoded levels and an index, read through mmap. Opening an archive only reads its header;
+    loading a level reads its index entry and its own bytes, no matter how many other levels are in the file.
+
+    Layout: header (magic b"RLVA", format version, number of levels, offset of the index), the levels one after
+    another, and at the end the index: offset and length of every level.
+    """
+
+    MAGIC   = b"RLVA"
+    VERSION = 1
+    HEADER  = struct.Struct("<4sHIQ")
+    ENTRY   = struct.Struct("<QI")
+
+    def __init__(self, file_name):
+        """
+        Open an archive for reading. An empty, short or foreign file raises an error, and nothing stays open.
+        """
+
+        self.file   = open(file_name, "rb")
+        self.mmap   = None
+
+        try:
+            self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)     # ValueError if empty
+            magic, version, self.count, self.index_offset = LevelArchive.HEADER.unpack_from(self.mmap)
+            if magic != LevelArchive.MAGIC:
+                raise ValueError(f"{file_name} is not a level archive.")
+            if version != LevelArchive.VERSION:
+                raise ValueError(f"Unsupported archive version {version}, expected {LevelArchive.VERSION}.")
+        except (ValueError, struct.error):
+            self.close()
+            raise
+
+    @staticmethod
+    def write(file_name, levels):
+        """
+        Writes an archive from encoded levels (bytes from LevelCodec.encode), in this order.
+        """
+
+        entries = []
+        with open(file_name, "wb") as file:
+            file.write(bytes(LevelArchive.HEADER.size))             # placeholder, the index offset comes last
+            offset = LevelArchive.HEADER.size
+            for level in levels:
+                file.write(level)
+                entries.append((offset, len(level)))
+                offset += len(level)
+
+            file.write(b"".join(LevelArchive.ENTRY.pack(*entry) for entry in entries))
+            file.seek(0)
+            file.write(LevelArchive.HEADER.pack(LevelArchive.MAGIC, LevelArchive.VERSION, len(entries), offset))
+
+    def level_bytes(self, number):
+        """
+        Returns the encoded bytes of level number, without decoding them.
+        """
+
+        if not 0 <= number < self.count:
+            raise IndexError(f"Level {number} is not in this archive ({self.count} levels).")
+
+        offset, length = LevelArchive.ENTRY.unpack_from(self.mmap, self.index_offset + number * LevelArchive.ENTRY.size)
+
+        return self.mmap[offset:offset + length]
+
+    def __getitem__(self, number):
+        """
+        Loads level number as a Dungeon.
+        """
+
+        return LevelCodec.decode(self.level_bytes(number))
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        if self.mmap is not None:
+            self.mmap.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+class LevelCorpus:
+    """
+    A store for large numbers of generated levels that can be searched by their features, in an SQLite database.
+    Every level is stored encoded (LevelCodec) together with a few numbers computed when it goes in:
+
+    room_count       : number of rooms
+    corridor_length  : corridor tiles, summed over all corridors
+    routed_corridors : corridors that needed the router (BFS, A*, JPS) instead of a simple L-shape
+    exit_distance    : steps from the player's start (center of the first room) to the exit
+    dead_ends        : rooms with only one corridor
+
+    Each feature has its own index, so "12-room levels with a long way to the exit" is a range query on the
+    index and not a scan over millions of levels.
+    """
+
+    FEATURES = ("room_count", "corridor_length", "routed_corridors", "exit_distance", "dead_ends")
+
+    def __init__(self, file_name=":memory:"):
+        """
+        Open (or create) a corpus.
+        """
+
+        self.connection = sqlite3.connect(file_name)
+
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS levels (id INTEGER PRIMARY KEY, seed INTEGER, config TEXT, "
+                + ", ".join(f"{feature} INTEGER" for feature in LevelCorpus.FEATURES) + ", level BLOB)"
+            )
+            for feature in LevelCorpus.FEATURES:
+                self.connection.execute(f"CREATE INDEX IF NOT EXISTS levels_{feature} ON levels ({feature})")
+
+    @staticmethod
+    def features(dungeon):
+        """
+        Computes the features of a generated level, in the order of FEATURES.
+        """
+
+        corridor_length  = sum(len(corridor.path) for corridor in dungeon.corridors if corridor.path)
+        routed_corridors = sum(corridor.mode not in ("hv", "vh") for corridor in dungeon.corridors)
+
+        degrees = [0] * len(dungeon.rooms)
+        for corridor in dungeon.corridors:
+            degrees[corridor.room1.id] += 1
+            degrees[corridor.room2.id] += 1
+
+        exit_distance = dungeon.walking_distance(dungeon.rooms[0].center, dungeon.exit)
+
+        return len(dungeon.rooms), corridor_length, routed_corridors, exit_distance, degrees.count(1)
+
+    @staticmethod
+    def row(dungeon):
+        """
+        Everything insert() needs for one level. Computing this is the expensive part, so pool workers can do it
+        and only hand the finished rows to the process that owns the database.
+        """
+
+        return (dungeon.seed, dungeon.config.fingerprint(), *LevelCorpus.features(dungeon), LevelCodec.encode(dungeon))
+
+    def insert(self, rows):
+        """
+        Inserts rows (from row()) in a single transaction and returns the IDs of the new levels. One transaction per
+        batch matters a lot: committing each level on its own means one sync to disk per level.
+        """
+
+        columns = ("seed", "config") + LevelCorpus.FEATURES + ("level",)
+        query   = f"INSERT INTO levels ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+
+        with self.connection:
+            cursor = self.connection.cursor()
+            ids    = []
+            for row in rows:
+                cursor.execute(query, row)
+                ids.append(cursor.lastrowid)
+
+        return ids
+
+    def query(self, config=None, limit=None, **ranges):
+        """
+        Returns the IDs of all levels whose features lie in the given ranges, like
+        query(room_count=(12, 12), exit_distance=(60, None)). A range is (low, high), both inclusive, and None
+        leaves that end open. config (a GeneratorConfig) limits the search to levels generated with it. With limit,
+        the result is any limit of the matching levels.
+
+        The IDs are sorted here and not with ORDER BY: SQLite would rather scan the whole table in ID order than use
+        a feature index and sort afterwards.
+        """
+
+        conditions, parameters = [], []
+
+        for feature, (low, high) in ranges.items():
+            if feature not in LevelCorpus.FEATURES:
+                raise ValueError(f"Unknown feature: {feature}. Valid features: {', '.join(LevelCorpus.FEATURES)}")
+            if low is not None:
+                conditions.append(f"{feature} >= ?")
+                parameters.append(low)
+            if high is not None:
+                conditions.append(f"{feature} <= ?")
+                parameters.append(high)
+
+        if config is not None:
+            conditions.append("config = ?")
+            parameters.append(config.fingerprint())
+
+        query = "SELECT id FROM levels"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        if limit is not None:
+            query += " LIMIT ?"
+            parameters.append(limit)
+
+        return sorted(level_id for level_id, in self.connection.execute(query, parameters))
+
+    def load(self, level_id):
+        """
+        Loads a level from the corpus as a Dungeon.
+        """
+
+        row = self.connection.execute("SELECT level FROM levels WHERE id = ?", (level_id,)).fetchone()
+        if row is None:
+            raise KeyError(f"No level with ID {level_id} in this corpus.")
+
+        return LevelCodec.decode(row[0])
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM levels").fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+@namespace
+class LevelAnalytics:
+    """
+    Statistics over whole batches of levels (LevelRecords of the same size), computed with NumPy array operations
+    instead of one Python loop per level. The levels are stacked into one array of shape (levels, height, width),
+    and every step (counting, flooding, shortest paths) works on all levels of a chunk at once.
+    """
+
+    @staticmethod
+    def room_counts(records):
+        """
+        Number of rooms per level.
+        """
+
+        return np.fromiter((len(record.rooms) for record in records), dtype=np.int32, count=len(records))
+
+    @staticmethod
+    def corridor_lengths(records):
+        """
+        Length of every corridor of every level, in one flat array.
+        """
+
+        return np.fromiter((length for record in records for _, _, length in record.corridors), dtype=np.int32)
+
+    @staticmethod
+    def stack_tiles(records):
+        """
+        The tiles of all levels as one uint8 array of shape (levels, height, width), without copying level by level.
+        """
+
+        height, width = records[0].height, records[0].width
+
+        return np.frombuffer(b"".join(record.tiles for record in records), dtype=np.uint8).reshape(-1, height, width)
+
+    @staticmethod
+    def heatmap(tiles):
+        """
+        For every tile position, the share of levels in which it is not rock (part of a room or a corridor).
+        """
+
+        return (tiles != Tile.ROCK).mean(axis=0)
+
+    @staticmethod
+    def diameters(records):
+        """
+        The diameter of the room graph of every level: the largest number of corridors between two rooms on the
+        shortest way. Floyd-Warshall for all levels at once, on distance matrices padded to the largest room count.
+        Levels whose rooms are not all connected get -1.
+        """
+
+        size      = max(len(record.rooms) for record in records)
+        distances = np.full((len(records), size, size), np.inf)
+        levels    = np.fromiter((number for number, record in enumerate(records) for _ in record.corridors), dtype=np.intp)
+        room1     = np.fromiter((a for record in records for a, _, _ in record.corridors), dtype=np.intp)
+        room2     = np.fromiter((b for record in records for _, b, _ in record.corridors), dtype=np.intp)
+
+        distances[levels, room1, room2] = 1
+        distances[levels, room2, room1] = 1
+        distances[:, np.arange(size), np.arange(size)] = 0
+
+        for k in range(size):
+            np.minimum(distances, distances[:, :, k, None] + distances[:, None, k, :], out=distances)
+
+        counts = LevelAnalytics.room_counts(records)
+        valid  = (np.arange(size) < counts[:, None])                   # the padding rooms don't exist
+        valid  = valid[:, :, None] & valid[:, None, :]
+        largest = np.where(valid, distances, 0).max(axis=(1, 2))
+
+        return np.where(np.isinf(largest), -1, largest).astype(np.int32)
+
+    @staticmethod
+    def exit_distances(records, tiles):
+        """
+        Steps from the player's start (center of the first room) to the exit for every level: a BFS that moves the
+        frontiers of all levels at once, one step per iteration, by shifting the boolean arrays. Levels without a
+        way to the exit get -1.
+        """
+
+        count     = len(tiles)
+        levels    = np.arange(count)
+        walkable  = np.frombuffer(Tile.WALKABLE, dtype=np.uint8).astype(bool)[tiles]
+        first     = np.array([record.rooms[0] for record in records])    # x, y, width, height
+        exits     = np.array([record.exit for record in records])
+
+        reached   = np.zeros_like(walkable)                             # the start is the center, like Room.center
+        reached[levels, first[:, 1] + first[:, 3] // 2, first[:, 0] + first[:, 2] // 2] = True
+        distances = np.full(count, -1, dtype=np.int32)
+        frontier  = reached.copy()
+        step      = 0
+
+        while True:
+            found = frontier[levels, exits[:, 1], exits[:, 0]] & (distances == -1)
+            distances[found] = step
+            if not frontier.any() or (distances != -1).all():
+                return distances
+
+            grown = np.zeros_like(frontier)                             # 4 neighbors of every frontier tile
+            grown[:, 1:, :]  |= frontier[:, :-1, :]
+            grown[:, :-1, :] |= frontier[:, 1:, :]
+            grown[:, :, 1:]  |= frontier[:, :, :-1]
+            grown[:, :, :-1] |= frontier[:, :, 1:]
+
+            frontier = grown & walkable & ~reached
+            reached |= frontier
+            step += 1
+
+    @staticmethod
+    def analyze(records, chunk_size=ANALYTICS_CHUNK_SIZE):
+        """
+        All statistics for a batch of records, as a dictionary of arrays. The per-level arrays are in the order of
+        the records. Tiles, distances and shortest paths are computed in chunks of chunk_size levels, so memory stays
+        bounded for large batches.
+        """
+
+        heat        = np.zeros((records[0].height, records[0].width))
+        diameters   = []
+        distances   = []
+
+        for start in range(0, len(records), chunk_size):
+            chunk = records[start:start + chunk_size]
+            tiles = LevelAnalytics.stack_tiles(chunk)
+            heat += LevelAnalytics.heatmap(tiles) * len(chunk)
+            diameters.append(LevelAnalytics.diameters(chunk))
+            distances.append(LevelAnalytics.exit_distances(chunk, tiles))
+
+        return {
+            "room_counts"     : LevelAnalytics.room_counts(records),
+            "corridor_lengths": LevelAnalytics.corridor_lengths(records),
+            "heatmap"         : heat / len(records),
+            "diameters"       : np.concatenate(diameters),
+            "exit_distances"  : np.concatenate(distances)
+        }
+
+
+class WorldMap:
+    """
+    The map of a ChunkedWorld, seen through the same interface as a TileMap (get, is_walkable, in_bounds), but in
+    world coordinates and without borders. Every lookup pulls the chunk it needs from the world, so the Player and
+    the game loop don't have to know that there are chunks at all.
+    """
+
+    __slots__ = ("world",)
+
+    def __init__(self, world):
+        self.world = world
+
+    def in_bounds(self, x, y):
+        """
+        The world has no borders.
+        """
+
+        return True
+
+    def get(self, x, y):
+        """
+        Returns the tile code at world coordinates x,y.
+        """
+
+        dungeon, local_x, local_y = self.world.locate(x, y)
+
+        return dungeon.map.get(local_x, local_y)
+
+    def is_walkable(self, x, y):
+        """
+        Checks if the player can walk to world coordinates x,y.
+        """
+
+        return Tile.WALKABLE[self.get(x, y)] == 1
+
+
+class ChunkedWorld:
+    """
+    An endless dungeon, made of chunks. Every chunk is a normal Dungeon of config.width x config.height tiles, and
+    chunk (cx, cy) covers the world tiles from (cx * width, cy * height) on. Chunks are only generated when somebody
+    looks at them, and the least recently used ones are dropped once there are more than capacity of them.
+
+    Hardly anything has to be stored for a dropped chunk: its seed is derived from the world seed and its
+    coordinates, so it comes back exactly the same when the player returns. Only the player's fog of war is kept,
+    packed with FogOfWar.to_bytes (a few dozen bytes per visited chunk), and put back when the chunk is rebuilt.
+
+    Neighboring chunks are connected through portals: one tile on each shared border, placed by a seed of its own.
+    Both chunks know where the portal on their common border is without ever looking at each other, and each of
+    them digs a corridor from its nearest room to its side of the border. The two halves meet at the portal, no
+    matter in which order (or how often) the chunks are generated.
+    """
+
+    def __init__(self, seed=None, config=None, capacity=CHUNK_CACHE_SIZE):
+        """
+        Create a world. Nothing is generated here, chunks come later, on demand.
+        """
+
+        self.seed      = seed if seed is not None else random.getrandbits(SEED_BITS)
+        self.config    = config if config is not None else GeneratorConfig.preset(WORLD_PRESET)
+        self.capacity  = capacity
+        self.chunks    = OrderedDict()          # (cx, cy) -> Dungeon, least recently used chunk first
+        self.fogs      = {}                     # (cx, cy) -> packed fog of war of an evicted chunk
+        self.map       = WorldMap(self)
+        self.generated = 0                      # number of chunks generated so far, including regenerated ones
+
+    def derive_seed(self, *key):
+        """
+        Derives a seed from the world seed and a key, e.g. ("chunk", cx, cy).
+        """
+
+        return derive_seed(self.seed, *key)
+
+    def portals(self, cx, cy):
+        """
+        Returns the four portal tiles of chunk cx,cy in local coordinates: east, west, south, north.
+        The portal between two chunks belongs to their shared border ("x" borders run between cx and cx + 1,
+        "y" borders between cy and cy + 1), so both chunks find the same position.
+        Portals keep away from the corners, since rooms never touch the outermost ring of tiles.
+        """
+
+        width, height = self.config.width, self.config.height
+
+        def position(axis, bx, by, length):
+            return random.Random(self.derive_seed("border", axis, bx, by)).randint(1, length - 2)
+
+        return [
+            (width - 1, position("x", cx,     cy,     height)),    # east
+            (0,         position("x", cx - 1, cy,     height)),    # west
+            (position("y", cx, cy,     width), height - 1),        # south
+            (position("y", cx, cy - 1, width), 0)                  # north
+        ]
+
+    def get_chunk(self, cx, cy):
+        """
+        Returns the chunk at chunk coordinates cx,cy. It comes from the cache if possible, otherwise it is generated.
+        """
+
+        key     = (cx, cy)
+        dungeon = self.chunks.get(key)
+        if dungeon is not None:
+            self.chunks.move_to_end(key)        # mark as most recently used
+            return dungeon
+
+        dungeon = self.build_chunk(cx, cy)
+        if key in self.fogs:                    # the player has been here before
+            dungeon.fog = FogOfWar.from_bytes(self.fogs.pop(key))
+
+        self.chunks[key] = dungeon
+        if len(self.chunks) > self.capacity:
+            evicted_key, evicted = self.chunks.popitem(last=False)  # evict the least recently used chunk
+            if evicted.fog.rooms or any(evicted.fog.explored):      # but keep what the player knows about it
+                self.fogs[evicted_key] = evicted.fog.to_bytes()
+
+        return dungeon
+
+    def build_chunk(self, cx, cy):
+        """
+        Generates chunk cx,cy and digs the corridors from its rooms to its four portals.
+
+        Each portal gets a corridor from the closest room (center to portal, Manhattan distance). The corridor is a
+        normal Corridor whose both ends belong to that room, from its new door to the portal tile on the border.
+        """
+
+        dungeon = Dungeon(self.config)
+        dungeon.generate(self.derive_seed("chunk", cx, cy))
+        self.generated += 1
+
+        rng = random.Random(self.derive_seed("portals", cx, cy))
+        obstacles = ObstacleMap(dungeon.room_grid)  # generate() dropped its own, the portal corridors need a new one
+        for portal in self.portals(cx, cy):
+            room = min(dungeon.rooms,
+                       key=lambda candidate: abs(candidate.center[0] - portal[0]) + abs(candidate.center[1] - portal[1]))
+            door = Door.choose_door(room, Room(portal[0], portal[1], 1, 1, -1), rng)
+
+            path, mode, expanded = Corridor.get_corridor_path(door, portal, obstacles, dungeon.router)
+            if not path:
+                continue                        # a dead portal, the chunk stays reachable through the others
+
+            dungeon.map.set_many(path, Tile.CORRIDOR)
+            dungeon.map.set(*door, Tile.DOOR)
+            dungeon.corridors.append(Corridor(room, room, door, portal, path, mode, expanded))
+
+        dungeon.index_doors()                   # the portal corridors added doors
+
+        return dungeon
+
+    def locate(self, x, y):
+        """
+        Translates world coordinates into (chunk, local x, local y), generating the chunk if needed.
+        divmod rounds towards minus infinity, so this works for negative coordinates, too.
+        """
+
+        cx, local_x = divmod(x, self.config.width)
+        cy, local_y = divmod(y, self.config.height)
+
+        return self.get_chunk(cx, cy), local_x, local_y
+
+    def chunks_in(self, x, y, width, height):
+        """
+        Returns the chunk coordinates of all chunks that overlap the width x height rectangle at world x,y.
+        """
+
+        return [(cx, cy)
+                for cy in range(y // self.config.height, (y + height - 1) // self.config.height + 1)
+                for cx in range(x // self.config.width, (x + width - 1) // self.config.width + 1)]
+
+    @property
+    def rooms(self):
+        """
+        The rooms of the chunk at the world origin. Its local coordinates are world coordinates,
+        so Player.initialize can pick a start position from them as in a single dungeon.
+        """
+
+        return self.get_chunk(0, 0).rooms
+
+    def get_room_at(self, x, y):
+        """
+        Finds the room at world coordinates x,y (or returns None).
+        """
+
+        dungeon, local_x, local_y = self.locate(x, y)
+
+        return dungeon.get_room_at(local_x, local_y)
+
+    def update_corridor_visibility(self, player_x, player_y):
+        """
+        Same as Dungeon.update_corridor_visibility, in world coordinates. The chunk of the player does the work;
+        only the neighbor tiles across a chunk border are handled here.
+        """
+
+        dungeon, local_x, local_y = self.locate(player_x, player_y)
+        dungeon.update_corridor_visibility(local_x, local_y)
+
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                neighbor, nx, ny = self.locate(player_x + dx, player_y + dy)
+                if neighbor is not dungeon and neighbor.map.get(nx, ny) in (Tile.CORRIDOR, Tile.DOOR):
+                    neighbor.reveal_tile(nx, ny)
+
+    def reveal_room_at(self, x, y):
+        """
+        Same as Dungeon.reveal_room_at, in world coordinates.
+        """
+
+        dungeon, local_x, local_y = self.locate(x, y)
+        dungeon.reveal_room_at(local_x, local_y)
+
+
+@namespace
+class FloorSnapshot:
+    """
+    A floor the player is not on, packed into bytes: the level (LevelCodec, compressed once more with zlib), the
+    player's fog of war (FogOfWar.to_bytes: explored tiles and rooms), and the entity state (Dungeon.entities, as
+    JSON: so far only where the player left the floor, which is where the game loop puts them when they come back).
+    A console level takes about 0.6 KB like this, instead of a Dungeon with all its objects, path tuples and
+    room grid.
+
+    header: magic b"RFLS", format version, and the lengths of the three parts
+    """
+
+    MAGIC   = b"RFLS"
+    VERSION = 1
+    HEADER  = struct.Struct("<4sHIII")
+
+    @staticmethod
+    def take(dungeon):
+        """
+        Packs a dungeon into a snapshot.
+        """
+
+        level    = zlib.compress(LevelCodec.encode(dungeon))
+        fog      = dungeon.fog.to_bytes()
+        entities = json.dumps(dungeon.entities).encode()
+
+        return b"".join((FloorSnapshot.HEADER.pack(FloorSnapshot.MAGIC, FloorSnapshot.VERSION,
+                                                   len(level), len(fog), len(entities)), level, fog, entities))
+
+    @staticmethod
+    def restore(snapshot):
+        """
+        Unpacks a snapshot into a Dungeon, with the fog of war and the entities exactly as the player left them.
+        """
+
+        magic, version, level_size, fog_size, entities_size = FloorSnapshot.HEADER.unpack_from(snapshot)
+        if magic != FloorSnapshot.MAGIC or version != FloorSnapshot.VERSION:
+            raise ValueError("Not a floor snapshot (or one of another version).")
+
+        start   = FloorSnapshot.HEADER.size
+        dungeon = LevelCodec.decode(zlib.decompress(snapshot[start:start + level_size]))
+        start  += level_size
+        dungeon.fog = FogOfWar.from_bytes(snapshot[start:start + fog_size])
+        start  += fog_size
+        dungeon.entities = json.loads(snapshot[start:start + entities_size])
+
+        return dungeon
+
+
+class FloorCache:
+    """
+    Keeps the snapshots of the floors the player is not on, by depth. Up to capacity bytes of them stay in memory;
+    beyond that, the least recently used snapshots are written to files in directory (a temporary directory by
+    default) and read back when they are needed. Either way, memory no longer grows with every visited floor.
+    """
+
+    def __init__(self, capacity=FLOOR_CACHE_BYTES, directory=FLOOR_SPILL_DIRECTORY):
+        """
+        Create an empty cache. Nothing is written to disk before the first snapshot has to go there.
+        """
+
+        self.capacity  = capacity
+        self.directory = directory
+        self.temporary = False                  # True if the cache made its directory and has to remove it
+        self.memory    = OrderedDict()          # depth -> snapshot, least recently used first
+        self.size      = 0                      # bytes in memory
+        self.files     = {}                     # depth -> file name of a spilled snapshot
+
+    def put(self, depth, snapshot):
+        """
+        Adds (or replaces) the snapshot of a floor and spills old snapshots to disk if memory is full.
+        """
+
+        self.pop(depth)
+        self.memory[depth] = snapshot
+        self.size += len(snapshot)
+
+        while self.size > self.capacity:
+            old_depth, old_snapshot = self.memory.popitem(last=False)
+            self.size -= len(old_snapshot)
+            self.spill(old_depth, old_snapshot)
+
+    def spill(self, depth, snapshot):
+        """
+        Writes one snapshot to disk.
+        """
+
+        if self.directory is None:
+            self.directory = tempfile.mkdtemp(prefix="floors_")
+            self.temporary = True
+
+        file_name = os.path.join(self.directory, f"floor_{depth}.snapshot")
+        with open(file_name, "wb") as file:
+            file.write(snapshot)
+        self.files[depth] = file_name
+
+    def pop(self, depth):
+        """
+        Takes the snapshot of a floor out of the cache (from memory or from disk), or returns None if there is none.
+        """
+
+        if depth in self.memory:
+            snapshot = self.memory.pop(depth)
+            self.size -= len(snapshot)
+            return snapshot
+
+        if depth in self.files:
+            file_name = self.files.pop(depth)
+            with open(file_name, "rb") as file:
+                snapshot = file.read()
+            os.remove(file_name)
+            return snapshot
+
+        return None
+
+    def __contains__(self, depth):
+        return depth in self.memory or depth in self.files
+
+    def __len__(self):
+        return len(self.memory) + len(self.files)
+
+    def close(self):
+        """
+        Removes the spilled files (and the temporary directory).
+        """
+
+        for file_name in self.files.values():
+            os.remove(file_name)
+        self.files.clear()
+        if self.temporary:
+            os.rmdir(self.directory)
+            self.directory, self.temporary = None, False
+
+
+class FloorStack:
+    """
+    A dungeon of many floors, one Dungeon each, stacked on top of each other and linked by stairs: the exit (">")
+    of a floor leads down to the up stairs ("<") of the next floor, and those lead back up to the exit.
+    Every floor is generated from a seed derived from the dungeon seed, like the chunks of a ChunkedWorld, and
+    validated like the levels of a batch (a floor the player cannot cross is generated again).
+
+    While the player is on a floor, the floor below is already being generated in a worker process (a
+    ProcessPoolExecutor with one worker, so the game loop does not compete with the generator for the GIL).
+    When the player goes down the stairs, the floor is ready, and there is no pause for the generator at all.
+    The worker sends the floor back encoded with LevelCodec, which is much cheaper to move between processes
+    than a pickled Dungeon, and decoding it takes well under a millisecond.
+
+    Only the floor the player is on is a Dungeon. All floors visited before are packed into FloorSnapshots in a
+    FloorCache and unpacked again when the player comes back, with their fog of war exactly as it was.
+    """
+
+    def __init__(self, seed=None, config=None, prefetch=FLOOR_PREFETCH, cache=None):
+        """
+        Create the dungeon with its first floor. With prefetch, the second floor is started right away.
+        cache is the FloorCache for the floors the player is not on (a new one with the default size if None).
+        """
+
+        self.seed    = seed if seed is not None else random.getrandbits(SEED_BITS)
+        self.config  = config if config is not None else GeneratorConfig.preset(FLOOR_PRESET)
+        self.cache   = cache if cache is not None else FloorCache()
+        self.floor   = None                     # the Dungeon the player is on
+        self.count   = 0                        # number of floors generated so far, 0 is the top floor
+        self.depth   = 0                        # where the player is
+        self.pool    = ProcessPoolExecutor(max_workers=1) if prefetch else None
+        self.pending = None                     # (depth, future) of the floor that is being generated
+
+        self.floor = self.get_floor(0)
+        self.prefetch(1)
+
+    @property
+    def current(self):
+        """
+        The floor the player is on.
+        """
+
+        return self.floor
+
+    def floor_seed(self, depth):
+        """
+        The seed of the floor at depth, derived from the dungeon seed.
+        """
+
+        return derive_seed(self.seed, "floor", depth)
+
+    @staticmethod
+    def generate_floor(seed, config=None):
+        """
+        Generates a floor and checks that it is in one piece (see Connectivity). A broken floor is thrown away and
+        generated again from a seed derived from the old one, so the dungeon is still the same on every run.
+        """
+
+        while True:
+            dungeon = Dungeon(config)
+            dungeon.generate(seed)
+            if Connectivity.validate(dungeon).connected:
+                return dungeon
+
+            seed = derive_seed(seed, "retry")
+
+    @staticmethod
+    def generate_floor_bytes(seed, config=None):
+        """
+        The job of the worker: generate_floor, encoded with LevelCodec.
+        """
+
+        return LevelCodec.encode(FloorStack.generate_floor(seed, config))
+
+    def prefetch(self, depth):
+        """
+        Starts generating the floor at depth in the worker, unless it exists or is on its way already.
+        """
+
+        if self.pool is None or depth < self.count or self.pending is not None:
+            return
+
+        future = self.pool.submit(FloorStack.generate_floor_bytes, self.floor_seed(depth), self.config)
+        self.pending = (depth, future)
+
+    def get_floor(self, depth):
+        """
+        Returns the floor at depth: a visited floor from its snapshot, a new floor from the worker if it was
+        prefetched (waiting for it only if it is not finished yet), otherwise generated right here. Floors can only
+        be added one by one.
+        """
+
+        if depth == self.depth and self.floor is not None:
+            return self.floor
+
+        if depth < self.count:
+            return FloorSnapshot.restore(self.cache.pop(depth))
+
+        if self.pending is not None and self.pending[0] == depth:
+            dungeon = LevelCodec.decode(self.pending[1].result())
+            self.pending = None
+        else:
+            dungeon = FloorStack.generate_floor(self.floor_seed(depth), self.config)
+
+        if depth > 0:                           # every floor but the top one has stairs up, in the first room
+            x, y = dungeon.rooms[0].center
+            if (x, y) == dungeon.exit:
+                x -= 1                          # rooms are at least 3 tiles wide inside, so this is still floor
+            dungeon.map.set(x, y, Tile.UP_STAIRS)
+            dungeon.stairs_up = (x, y)
+
+        self.count += 1
+
+        return dungeon
+
+    def go_to(self, depth):
+        """
+        Packs the current floor into the cache and makes the floor at depth the current one.
+        """
+
+        self.cache.put(self.depth, FloorSnapshot.take(self.floor))
+        self.floor = None                       # the snapshot is all that is left of it
+        self.floor = self.get_floor(depth)
+        self.depth = depth
+
+        return self.floor
+
+    def descend(self):
+        """
+        Goes down one floor and starts the one below it. Returns the new floor.
+        """
+
+        dungeon = self.go_to(self.depth + 1)
+        self.prefetch(self.depth + 1)
+
+        return dungeon
+
+    def ascend(self):
+        """
+        Goes up one floor (never above the top floor). Returns the new floor.
+        """
+
+        if self.depth == 0:
+            return self.floor
+
+        return self.go_to(self.depth - 1)
+
+    def close(self):
+        """
+        Stops the worker, dropping a floor that is still being generated, and cleans up the cache.
+        """
+
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+        self.cache.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+class Utilities:
+    @staticmethod
+    def set_bits(number):
+        """
+        Yields the positions of all 1 bits of a non-negative integer, lowest first.
+        number & -number isolates the lowest 1 bit, and its bit_length is the position (plus one).
+        """
+
+        while number:
+            lowest = number & -number
+            yield lowest.bit_length() - 1
+            number ^= lowest
+
+    @staticmethod
+    def print_map(dungeon_map):
+        """
+        Actually print the ASCII map.
+        """
+
+        print("\n".join(dungeon_map.rows()))
 
     @staticmethod
-    def add_extra_corridors(rooms, existing_connections, dungeon_map):
+    def test_mode():
         """
-        This is where I officially went nuts: This function tries to add even more corridors between nearby rooms
-        in order to create more labyrinth-like dungeon maps. The probability of adding extra corridors is randomized,
-        because why not? ;)
-
-        How it works:
-        - Iterate all possible room pairs.
-        - Skip pairs that are already connected.
-        - Skip pairs that are far apart (Manhattan distance > 25, see above).
-        - With a probability of 25%, attempt to create an extra connection:
-          - Determine door locations for both rooms.
-          - Use Corridor.get_corridor_path() in hv mode to find a corridor.
-          - If path is valid, update map, and store the corridor.
-          - To be thorough, I try vh mode next, and finally BFS.
+        This runs a large number of test levels to find out whether the code crashes or not.
+        It also measures running time, and checks that every level is fully connected.
         """
 
-        extra_corridors = []
+        total_time = 0.0
+        shortest, longest = float("inf"), 0.0  # float("inf") is infinite time
+        broken = 0
 
-        for i in range(len(rooms)):                                     # iterate all room pairs
-            for j in range(i + 1, len(rooms)):
-                room_a = rooms[i]
-                room_b = rooms[j]
-                # This is a frozenset instead of a set so I can add it to a set.
-                # Otherwise, I get a "TypeError: unhashable type: 'set'". I had to look this up. :)
-                connection_key = frozenset({room_a.id, room_b.id})
-                if connection_key in existing_connections:              # are the rooms already connected?
-                    continue
+        print(f"Creating {TEST_NUM} test levels...\n")
 
-                dx = abs(room_a.center[0] - room_b.center[0])           # calculate Manhattan distance
-                dy = abs(room_a.center[1] - room_b.center[1])
-                if dx + dy > THRESHOLD_DISTANCE_FOR_EXTRA_CORRIDORS:    # too far apart?
-                    continue
+        for i in range(TEST_NUM):
+            start_time = time.time()
+            dungeon = Dungeon()
+            dungeon.generate()
+            elapsed = (time.time() - start_time) * 1000
 
-                # Randomly decide to create an extra connection with 25% probability
-                if random.random() < PROBABILITY_FOR_EXTRA_CORRIDOR_CREATION:  # 25% probability
-                    door_a = Door.choose_door(room_a, room_b)
-                    door_b = Door.choose_door(room_b, room_a)
+            total_time += elapsed
+            shortest, longest = min(shortest, elapsed), max(longest, elapsed)
 
-                    path = Corridor.get_corridor_candidate_path(door_a, door_b, order="hv")      # hv mode
-                    mode_used = "hv"
+            print(f"Generated level {i + 1:4d} in {elapsed:6.2f} ms.")
 
-                    if not Corridor.is_valid_corridor(path, rooms):
-                        path = Corridor.get_corridor_candidate_path(door_a, door_b, order="vh")  # vh mode
-                        mode_used = "vh"
+            report = Connectivity.validate(dungeon)
+            if not report.connected:
+                broken += 1
+                print(f"Level {i + 1} (seed {dungeon.seed}) is not connected: {report}")
 
-                    if not Corridor.is_valid_corridor(path, rooms):
-                        path = Corridor.bfs_path(door_a, door_b, room_a, room_b, rooms)         # BFS mode
-                        mode_used = "BFS"
+        print("\nTest completed.")
+        print(f"Average time per level  {total_time / TEST_NUM:6.2f} ms.")
+        print(f"Shortest level creation {shortest:6.2f} ms.")
+        print(f"Longest level creation  {longest:6.2f} ms.")
+        print(f"Levels not connected    {broken:6d}.")
 
-                    if path and Corridor.is_valid_corridor(path, rooms):
-                        for (x, y) in path:
-                            if (x, y) == door_a or (x, y) == door_b:
-                                dungeon_map[y][x] = STANDARD_DOOR
-                            else:
-                                dungeon_map[y][x] = CORRIDOR_TILE
+    @staticmethod
+    def percentiles(samples):
+        """
+        p50, p95, and p99 of a list of samples (with at least two samples, interpolated like numpy's default).
+        """
 
-                        if DEBUG_MODE["extra_corridor_generation"]:
-                            print(f"## Whoa, I just built an extra corridor in {mode_used} mode between {room_a} and {room_b}!")
-                        extra_corridors.append(Corridor(room_a, room_b, door_a, door_b, path))
-                        existing_connections.add(connection_key)
+        cuts = statistics.quantiles(samples, n=100, method="inclusive")
 
-        return extra_corridors
+        return {"p50": cuts[49], "p95": cuts[94], "p99": cuts[98]}
 
+    @staticmethod
+    def benchmark(seeds, config=None, warmup=BENCHMARK_WARMUP):
+        """
+        Times every stage of Dungeon.generate() (see StageTimer) on the same seeds every time, so two runs compare
+        the same work. A few warmup levels come first and are not counted: they fill the caches and let the
+        interpreter settle. Peak memory is measured in a second pass with tracemalloc, because tracing every
+        allocation slows down generation far too much to trust the times of the same pass.
 
-class Dungeon:
-    def __init__(self):
+        Returns a dictionary that can go straight into a JSON file: p50, p95, p99, and mean in microseconds for every
+        stage and for the whole level, plus the peak memory in KiB.
         """
-        Initialize an empty dungeon.
+
+        for seed in range(max(seeds) + 1, max(seeds) + 1 + warmup):    # seeds that are not part of the benchmark
+            Dungeon(config).generate(seed)
+
+        samples = {stage: [] for stage in StageTimer.STAGES + ("total",)}
+        for seed in seeds:
+            dungeon = Dungeon(config)
+            dungeon.instrumentation = StageTimer()
+            start_time = time.perf_counter_ns()
+            dungeon.generate(seed)
+            samples["total"].append(time.perf_counter_ns() - start_time)
+            for stage, elapsed in dungeon.instrumentation.times.items():
+                samples[stage].append(elapsed)
+
+        peak = 0
+        tracemalloc.start()
+        for seed in seeds:
+            tracemalloc.reset_peak()
+            Dungeon(config).generate(seed)
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+        stages = {}
+        for stage, times in samples.items():
+            times = [elapsed / 1000 for elapsed in times]               # ns -> µs
+            stages[stage] = {**Utilities.percentiles(times), "mean": statistics.fmean(times)}
+
+        return {"levels": len(seeds), "warmup": warmup, "stages_us": stages, "peak_memory_kib": peak / 1024}
+
+    @staticmethod
+    def compare_benchmarks(result, baseline, tolerance=BENCHMARK_TOLERANCE):
+        """
+        Compares a benchmark result with a baseline and returns the stages whose p50 or p95 got slower by more than
+        tolerance (0.1 = 10 %), as (stage, percentile, baseline µs, current µs) tuples.
         """
 
-        self.map       = []
-        self.rooms     = []
-        self.corridors = []
-        self.corridor_visibility = [
-            [False for _ in range(LEVEL_WIDTH)] for _ in range(LEVEL_HEIGHT)
-        ]
-        self.exit = None
+        regressions = []
+        for stage, current in result["stages_us"].items():
+            previous = baseline["stages_us"].get(stage)
+            if previous is None:
+                continue
+            for percentile in ("p50", "p95"):
+                if current[percentile] > previous[percentile] * (1 + tolerance):
+                    regressions.append((stage, percentile, previous[percentile], current[percentile]))
 
-    def generate(self):
+        return regressions
+
+    @staticmethod
+    def benchmark_mode():
+        """
+        Runs the stage benchmark on BENCHMARK_NUM fixed seeds, writes the result to BENCHMARK_FILE, and compares it
+        with BENCHMARK_BASELINE (if there is one). Copy a result file to the baseline to make it the new reference.
         """
-        Generate a dungeon level:
-        1. initialize the map by filling it with rock tiles
-        2. generate rooms
-        3. connect rooms with corridors
-        4. add extra corridors
 
-        The function returns all info about the dungeon, namely:
-        1. 2D grid of the level layout
-        2. [rooms]
-        3. [corridors]
+        config = GeneratorConfig.preset(BENCHMARK_PRESET)
+        seeds  = range(BENCHMARK_SEED, BENCHMARK_SEED + BENCHMARK_NUM)
+
+        print(f"Benchmarking {BENCHMARK_NUM} {BENCHMARK_PRESET} levels ({BENCHMARK_WARMUP} warmup levels)...\n")
+
+        result = Utilities.benchmark(seeds, config)
+        result.update(preset=BENCHMARK_PRESET, first_seed=BENCHMARK_SEED, config=config.fingerprint())
+
+        print(f"{'stage':>16} {'p50':>9} {'p95':>9} {'p99':>9} {'mean':>9}   (µs)")
+        for stage, times in result["stages_us"].items():
+            print(f"{stage:>16} {times['p50']:9.1f} {times['p95']:9.1f} {times['p99']:9.1f} {times['mean']:9.1f}")
+        print(f"\nPeak memory per level {result['peak_memory_kib']:8.1f} KiB.")
+
+        with open(BENCHMARK_FILE, "w") as file:
+            json.dump(result, file, indent=2)
+        print(f"Result written to {BENCHMARK_FILE}.")
+
+        if not BENCHMARK_BASELINE or not os.path.exists(BENCHMARK_BASELINE):
+            return
+
+        with open(BENCHMARK_BASELINE) as file:
+            baseline = json.load(file)
+        if baseline.get("config") != result["config"] or baseline.get("levels") != result["levels"]:
+            print(f"{BENCHMARK_BASELINE} was made with other settings, not comparing.")
+            return
+
+        regressions = Utilities.compare_benchmarks(result, baseline)
+        for stage, percentile, previous, current in regressions:
+            print(f"Slower: {stage} {percentile} {previous:9.1f} µs -> {current:9.1f} µs "
+                  f"({(current / previous - 1) * 100:+.0f} %)")
+        if not regressions:
+            print(f"No stage is more than {BENCHMARK_TOLERANCE * 100:.0f} % slower than {BENCHMARK_BASELINE}.")
+
+    @staticmethod
+    def generate_level_record(seed, config=None, instrument=False, validate=False):
+        """
+        Generates one level from an explicit seed (and a GeneratorConfig) and returns it as a LevelRecord.
+        This is the job each worker runs in batch mode, but it can be called directly as well to reproduce
+        any single level of a batch from its seed. With instrument, the record has the level's stats.
+        With validate, a level that is not fully connected (see Connectivity) is rejected: the result is None.
         """
 
-        self.map = self.let_there_be_rock()                     # create the abyss using both AC & DC
+        dungeon = Dungeon(config)
+        if instrument:
+            dungeon.instrumentation = Instrumentation()
+        dungeon.generate(seed)
 
-        self.rooms = Room.generate_rooms()                      # carve rooms into the foundations of the earth
-        for room in self.rooms:
-            Room.draw_room_on_map(room, self.map)               # ask Elrond for a map
+        if validate and not Connectivity.validate(dungeon).connected:
+            return None
 
-        exit_room = random.choice(self.rooms)
-        exit_x = random.randint(exit_room.x + 1, exit_room.x + exit_room.width - 2)
-        exit_y = random.randint(exit_room.y + 1, exit_room.y + exit_room.height - 2)
+        return dungeon.to_record(seed)
 
-        self.exit = (exit_x, exit_y)
-        self.map[exit_y][exit_x] = EXIT_TILE
+    @staticmethod
+    def generate_level_bytes(seed, config=None):
+        """
+        Generates one level from an explicit seed and returns it encoded with LevelCodec (for level archives).
+        """
 
-        corridor_edges = Corridor.connect_rooms_by_mst(self.rooms)  # let the dwarves dig the corridors
-        self.corridors = []
-        existing_connections = set()
+        dungeon = Dungeon(config)
+        dungeon.generate(seed)
 
-        for room_a, room_b, door_a, door_b in corridor_edges:
-            path = Corridor.get_corridor_path(door_a, door_b, room_a, room_b, self.rooms)
+        return LevelCodec.encode(dungeon)
 
-            self.corridors.append(
-                Corridor(room_a, room_b, door_a, door_b, path)
-            )
+    @staticmethod
+    def archive_mode():
+        """
+        Packs ARCHIVE_NUM levels (seeds BATCH_SEED, BATCH_SEED + 1, ...) into the level archive ARCHIVE_FILE
+        on all cores, then measures how long it takes to load single levels from it.
+        """
 
-            for (x, y) in path:
-                self.map[y][x] = CORRIDOR_TILE                  # mark corridor on the map using moon runes
+        seeds   = range(BATCH_SEED, BATCH_SEED + ARCHIVE_NUM)
+        workers = BATCH_WORKERS or os.cpu_count()
+        config  = GeneratorConfig.preset(BATCH_PRESET)
 
-            self.map[door_a[1]][door_a[0]] = STANDARD_DOOR      # mark doors with Ithildin letters
-            self.map[door_b[1]][door_b[0]] = STANDARD_DOOR
+        print(f"Packing {ARCHIVE_NUM} {BATCH_PRESET} levels into {ARCHIVE_FILE}...\n")
 
-            existing_connections.add(
-                frozenset({room_a.id, room_b.id})               # as above, avoid a "TypeError: unhashable type: 'set'"
-            )
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            levels = pool.map(Utilities.generate_level_bytes, seeds, repeat(config), chunksize=BATCH_CHUNK_SIZE)
+            LevelArchive.write(ARCHIVE_FILE, levels)
 
-        # Add extra corridors, but don't dig to deep and beware of Balrogs!
-        extra_corridors = Corridor.add_extra_corridors(self.rooms, existing_connections, self.map)
-        self.corridors.extend(extra_corridors)
+        with LevelArchive(ARCHIVE_FILE) as archive:
+            numbers    = random.sample(range(len(archive)), min(1000, len(archive)))
+            start_time = time.perf_counter()
+            for number in numbers:
+                archive[number]
+            elapsed    = time.perf_counter() - start_time
 
-        self.corridor_visibility = [[False for _ in range(LEVEL_WIDTH)] for _ in range(LEVEL_HEIGHT)]
+        print(f"Archive size {os.path.getsize(ARCHIVE_FILE) / 1024:8.1f} KiB "
+              f"({os.path.getsize(ARCHIVE_FILE) / ARCHIVE_NUM:6.1f} bytes per level).")
+        print(f"Average load time {elapsed / len(numbers) * 1e6:6.1f} µs per level.")
 
     @staticmethod
-    def let_there_be_rock():
+    def generate_corpus_row(seed, config=None):
         """
-        🪨🤘🎸. (Sorry.)
+        Generates one level from an explicit seed and returns its row for the LevelCorpus (features and encoding).
         """
 
-        return [[ROCK_TILE for _ in range(LEVEL_WIDTH)] for _ in range(LEVEL_HEIGHT)]
+        dungeon = Dungeon(config)
+        dungeon.generate(seed)
 
-    def get_room_at(self, x, y):
+        return LevelCorpus.row(dungeon)
+
+    @staticmethod
+    def corpus_mode():
         """
-        Finds the room at given coordinates (or returns None).
+        Adds CORPUS_NUM levels (seeds BATCH_SEED, BATCH_SEED + 1, ...) to the corpus CORPUS_FILE, generated on all
+        cores and inserted in transactions of CORPUS_TRANSACTION_SIZE levels, then runs a sample query.
         """
 
-        for room in self.rooms:
-            if room.contains(x, y):
-                return room
+        seeds   = range(BATCH_SEED, BATCH_SEED + CORPUS_NUM)
+        workers = BATCH_WORKERS or os.cpu_count()
+        config  = GeneratorConfig.preset(BATCH_PRESET)
 
-        return None
+        print(f"Adding {CORPUS_NUM} {BATCH_PRESET} levels to {CORPUS_FILE}...\n")
 
-    def is_corridor(self, x, y):
+        with LevelCorpus(CORPUS_FILE) as corpus:
+            start_time = time.perf_counter()
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                rows = pool.map(Utilities.generate_corpus_row, seeds, repeat(config), chunksize=BATCH_CHUNK_SIZE)
+                while batch := list(islice(rows, CORPUS_TRANSACTION_SIZE)):
+                    corpus.insert(batch)
+            print(f"Inserted in {time.perf_counter() - start_time:6.2f} s, the corpus has {len(corpus)} levels.")
+
+            start_time = time.perf_counter()
+            level_ids  = corpus.query(config, room_count=(12, 12), exit_distance=(60, None))
+            elapsed    = time.perf_counter() - start_time
+            print(f"{len(level_ids)} levels with 12 rooms and an exit at least 60 steps away "
+                  f"(query took {elapsed * 1000:6.2f} ms).")
+
+    @staticmethod
+    def generate_batch(seeds, workers=None, configs=None, instrument=False, validate=BATCH_VALIDATE):
         """
-        Checks if the cell at any given coordinate is part of any corridor.
-        A more complicated solution would be:
-        return any((x, y) in corridor.path for corridor in self.corridors)
-        This might be necessary if this check would be done during the generation process. No idea if this might
-        happen, I just want to remember the line. :)
+        Generates one level per seed on a process pool (one worker per core if workers is None).
+        The records come back in the same order as the seeds.
+
+        configs is either one GeneratorConfig for all levels (None means the defaults), or a list with one config
+        per seed, so console levels and overworld maps can share the same pool. With instrument, every record
+        carries the stats of its level. With validate, the workers check every level right after generating it
+        and levels that are not fully connected are left out (compare the record seeds to find them).
         """
 
-        return self.map[y][x] == CORRIDOR_TILE
+        if configs is None or isinstance(configs, GeneratorConfig):
+            configs = repeat(configs)
 
-    def print(self):
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            records = pool.map(Utilities.generate_level_record, seeds, configs, repeat(instrument), repeat(validate),
+                               chunksize=BATCH_CHUNK_SIZE)
+            return [record for record in records if record is not None]
+
+    @staticmethod
+    def batch_mode():
         """
-        Prints the dungeon in ASCII mode. Added this just to have a print function within the Dungeon class.
+        Generates BATCH_NUM levels with the seeds BATCH_SEED, BATCH_SEED + 1, ... on all cores and measures
+        the throughput.
         """
 
-        Utilities.print_map(self.map)
+        seeds   = range(BATCH_SEED, BATCH_SEED + BATCH_NUM)
+        workers = BATCH_WORKERS or os.cpu_count()
+        config  = GeneratorConfig.preset(BATCH_PRESET)
+
+        print(f"Creating {BATCH_NUM} {BATCH_PRESET} levels ({config.width} x {config.height}) "
+              f"on {workers} worker processes...\n")
+
+        start_time = time.perf_counter()
+        records    = Utilities.generate_batch(seeds, workers, config, BATCH_INSTRUMENTATION)
+        elapsed    = time.perf_counter() - start_time
+
+        rooms = sum(len(record.rooms) for record in records)
+        print(f"Generated {len(records)} levels in {elapsed:6.2f} s ({len(records) / elapsed:8.1f} levels per second).")
+        if BATCH_VALIDATE:
+            print(f"Rejected {BATCH_NUM - len(records)} levels that were not fully connected.")
+        print(f"Average number of rooms {rooms / len(records):6.2f}.")
+        print(f"Seeds {BATCH_SEED} to {BATCH_SEED + BATCH_NUM - 1}, use Utilities.generate_level_record to reproduce one.")
+
+        if BATCH_INSTRUMENTATION:
+            with open(INSTRUMENTATION_FILE, "w") as file:             # one JSON object per line and level
+                for record in records:
+                    file.write(json.dumps({"seed": record.seed, **record.stats}) + "\n")
+
+            print(f"\nStats of every level written to {INSTRUMENTATION_FILE}. The slowest levels:")
+            slowest = sorted(records, key=lambda record: sum(record.stats["stage_times_us"].values()), reverse=True)
+            for record in slowest[:5]:
+                counters = record.stats["counters"]
+                print(f"Seed {record.seed:8}: {sum(record.stats['stage_times_us'].values()) / 1000:6.2f} ms, "
+                      f"{counters['overlap_rejections']:5} overlap rejections, "
+                      f"{counters['routed_corridors']:3} routed corridors, {counters['expanded_nodes']:6} expanded nodes.")
 
-    def update_corridor_visibility(self, player_x, player_y):
+    @staticmethod
+    def analytics_mode():
         """
-        Updates the corridor visibility based on the player's current position.
-        The current player position plus eight neighbor cells are revealed.
+        Generates ANALYTICS_NUM levels (seeds BATCH_SEED, BATCH_SEED + 1, ...) on all cores, prints the
+        distributions from LevelAnalytics, and saves all arrays to ANALYTICS_FILE (numpy.load reads them back).
         """
 
-        directions = [(-1, -1), ( 0, -1), ( 1, -1),     # above left, above  , above right
-                      (-1,  0), ( 0,  0), ( 1,  0),     # left      , current, right
-                      (-1,  1), ( 0,  1), ( 1,  1)]     # below left, below  , below right
+        if np is None:
+            raise ImportError("The analytics mode needs NumPy (pip install numpy).")
 
-        for dx, dy in directions:                                       # reveal adjacent doors and corridors
-            nx, ny = player_x + dx, player_y + dy                       # new x and y
-            if 0 <= nx < LEVEL_WIDTH and 0 <= ny < LEVEL_HEIGHT:        # within boundaries?
-                if self.map[ny][nx] in (CORRIDOR_TILE, STANDARD_DOOR):  # what kind of tile?
-                    self.corridor_visibility[ny][nx] = True
+        seeds  = range(BATCH_SEED, BATCH_SEED + ANALYTICS_NUM)
+        config = GeneratorConfig.preset(BATCH_PRESET)
 
-        player_room = self.get_room_at(player_x, player_y)              # reveal all doors from current room
-        # This checks every cell in the room, which is too much. I might skip the floor tiles, but I guess
-        # this will work so fast that it's not really worth changing it.
-        if player_room:
-            for row in range(player_room.y, player_room.y + player_room.height):
-                for column in range(player_room.x, player_room.x + player_room.width):
-                    if self.map[row][column] == STANDARD_DOOR:
-                        self.corridor_visibility[row][column] = True
+        print(f"Analyzing {ANALYTICS_NUM} {BATCH_PRESET} levels...\n")
 
+        records    = Utilities.generate_batch(seeds, BATCH_WORKERS, config)
+        start_time = time.perf_counter()
+        results    = LevelAnalytics.analyze(records)
+        elapsed    = time.perf_counter() - start_time
+
+        room_counts = np.bincount(results["room_counts"])
+        print("Rooms per level:")
+        for rooms in np.flatnonzero(room_counts):
+            print(f"{rooms:5} rooms {room_counts[rooms] / len(records) * 100:6.2f} %")
+
+        lengths = results["corridor_lengths"]
+        histogram, edges = np.histogram(lengths, bins=ANALYTICS_BINS)
+        print(f"\nCorridor lengths (mean {lengths.mean():.2f}, median {np.median(lengths):.0f}):")
+        for number, low, high in zip(histogram, edges, edges[1:]):
+            print(f"{low:6.1f} - {high:6.1f} {number:8}")
+
+        for name, label in (("diameters", "Room graph diameter"), ("exit_distances", "Steps from start to exit")):
+            values    = results[name]
+            connected = values[values >= 0]
+            print(f"\n{label}: mean {connected.mean():.2f}, p50 {np.percentile(connected, 50):.0f}, "
+                  f"p95 {np.percentile(connected, 95):.0f}, max {connected.max()}, unreachable {(values < 0).sum()}")
+
+        print(f"\nMost used tile {results['heatmap'].max() * 100:.1f} %, map covered on average "
+              f"{results['heatmap'].mean() * 100:.1f} %.")
+        print(f"Analysis took {elapsed:6.2f} s. Arrays saved to {ANALYTICS_FILE}.")
+        np.savez_compressed(ANALYTICS_FILE, **results)
 
-class Utilities:
     @staticmethod
-    def print_map(dungeon_map):
+    def init_headless():
         """
-        Actually print the ASCII map.
+        Runs once in every render worker: SDL's dummy video driver, so pygame never looks for a display.
         """
 
-        print("\n".join("".join(row) for row in dungeon_map))
+        os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
 
     @staticmethod
-    def test_mode():
+    def render_level_png(seed, directory, config=None, tile_size=RENDER_TILE_SIZE):
         """
-        This runs a large number of test levels to find out whether the code crashes or not.
-        It also measures running time.
+        Generates the level for a seed and saves it, fully revealed, as directory/level_<seed>.png.
+        Returns the file name.
         """
 
-        total_time = 0.0
-        shortest, longest = float("inf"), 0.0  # float("inf") is infinite time
+        dungeon = Dungeon(config)
+        dungeon.generate(seed)
 
-        print(f"Creating {TEST_NUM} test levels...\n")
+        visualizer = DungeonVisualizer(dungeon, tile_size=tile_size, headless=True)
+        file_name  = os.path.join(directory, f"level_{seed}.png")
+        pygame.image.save(visualizer.render_static(), file_name)
 
-        for i in range(TEST_NUM):
-            start_time = time.time()
-            dungeon = Dungeon()
-            dungeon.generate()
-            elapsed = (time.time() - start_time) * 1000
+        return file_name
 
-            total_time += elapsed
-            shortest, longest = min(shortest, elapsed), max(longest, elapsed)
+    @staticmethod
+    def render_batch(seeds, directory, workers=None, config=None, tile_size=RENDER_TILE_SIZE):
+        """
+        Renders one PNG per seed on a process pool (one worker per core if workers is None), without any display.
+        The file names come back in the same order as the seeds.
+        """
 
-            print(f"Generated level {i + 1:4d} in {elapsed:6.2f} ms.")
+        os.makedirs(directory, exist_ok=True)
 
-        print("\nTest completed.")
-        print(f"Average time per level  {total_time / TEST_NUM:6.2f} ms.")
-        print(f"Shortest level creation {shortest:6.2f} ms.")
-        print(f"Longest level creation  {longest:6.2f} ms.")
+        with ProcessPoolExecutor(max_workers=workers, initializer=Utilities.init_headless) as pool:
+            return list(pool.map(Utilities.render_level_png, seeds, repeat(directory), repeat(config),
+                                 repeat(tile_size), chunksize=BATCH_CHUNK_SIZE))
+
+    @staticmethod
+    def render_mode():
+        """
+        Renders RENDER_NUM levels (seeds BATCH_SEED, BATCH_SEED + 1, ...) to PNG files and measures the throughput.
+        """
+
+        seeds   = range(BATCH_SEED, BATCH_SEED + RENDER_NUM)
+        workers = BATCH_WORKERS or os.cpu_count()
+        config  = GeneratorConfig.preset(RENDER_PRESET)
+
+        print(f"Rendering {RENDER_NUM} {RENDER_PRESET} levels to {RENDER_DIRECTORY}/ on {workers} worker processes...\n")
+
+        start_time = time.perf_counter()
+        files      = Utilities.render_batch(seeds, RENDER_DIRECTORY, workers, config)
+        elapsed    = time.perf_counter() - start_time
+
+        print(f"Rendered {len(files)} levels in {elapsed:6.2f} s ({len(files) / elapsed:8.1f} levels per second).")
+
+    @staticmethod
+    def compare_routers():
+        """
+        Generates the same ROUTER_TEST_NUM levels (seeds 0, 1, 2, ...) with every router in ROUTERS and compares
+        how many nodes they expand and how long they take. The routers don't draw random numbers, so all of them
+        are asked for exactly the same corridors.
+        """
+
+        print(f"Comparing corridor routers on {ROUTER_TEST_NUM} levels...\n")
+
+        for name in ROUTERS:
+            expanded, routed, length = 0, 0, 0
+            start_time = time.perf_counter()
+
+            for seed in range(ROUTER_TEST_NUM):
+                dungeon = Dungeon(router=name)
+                dungeon.generate(seed)
+
+                expanded += dungeon.expanded_nodes
+                for corridor in dungeon.corridors:
+                    if corridor.mode == name and corridor.path:
+                        routed += 1
+                        length += len(corridor.path)
+
+            elapsed = time.perf_counter() - start_time
+            print(f"{name:>5}: {routed:6} routed corridors, {length / max(routed, 1):6.2f} tiles on average, "
+                  f"{expanded / max(routed, 1):8.1f} expanded nodes per corridor, "
+                  f"{elapsed / ROUTER_TEST_NUM * 1000:6.2f} ms per level.")
 
     @staticmethod
     def display_loop():
@@ -659,162 +3813,293 @@ class Utilities:
                     break
 
     @staticmethod
-    def game_loop():
+    def game_loop(world=None, floors=None):
         """
         Actual gameplay. Woohoo.
 
         It was complicated coding the keyboard input (with key repeats), and I had to look up some strategies for that.
+        In the end, the simplest one won: SDL repeats KEYDOWN events for held keys by itself (pygame.key.set_repeat),
+        so every step is just one event. The loop sleeps in pygame.event.wait until something happens, instead of
+        polling the keyboard and redrawing 60 times a second, and it only draws after something has changed.
+
+        Without a world, this plays one freshly generated dungeon. With a ChunkedWorld, the player starts in the
+        chunk at the origin and can walk on forever. With a FloorStack, ">" on the exit leads down to the next floor
+        and "<" on the stairs up leads back.
         """
 
-        dungeon = Dungeon()
-        dungeon.generate()
-        player = Player.initialize(dungeon, "random")
-        visualizer = DungeonVisualizer(dungeon, player)
+        if floors is not None:
+            dungeon = floors.current
+            player = Player.initialize(dungeon, "random")
+            visualizer = DungeonVisualizer(dungeon, player)
+        elif world is None:
+            dungeon = Dungeon()
+            dungeon.generate()
+            player = Player.initialize(dungeon, "random")
+            visualizer = DungeonVisualizer(dungeon, player)
+        else:
+            dungeon = world
+            player = Player.initialize(world, "random")
+            visualizer = WorldVisualizer(world, player)
 
         pygame.init()
-        clock = pygame.time.Clock()
-
-        rounds_counter = 0
+        pygame.key.set_repeat(INITIAL_DELAY, REPEAT_INTERVAL)      # held keys send KEYDOWN again and again
 
-        # This keeps track of the four directions (arrow keys and WASD)
-        key_states = {
-            "up"   : {"active": False, "first_press": 0, "last_move": 0},       # flag, timestamp, timestamp
-            "down" : {"active": False, "first_press": 0, "last_move": 0},
-            "left" : {"active": False, "first_press": 0, "last_move": 0},
-            "right": {"active": False, "first_press": 0, "last_move": 0}
-        }
+        # This maps every movement key (arrow keys and WASD) to its direction
+        key_directions = {key: direction for direction, key_list in KNOWN_KEYS.items() for key in key_list}
 
+        rounds_counter = 0
         running = True
 
         caption = f"Dungeon Level -- Rounds: {rounds_counter:4} -- "
         caption += f"Current Position: {player.x:3}/{player.y:3}"
         pygame.display.set_caption(caption)
+        pygame.display.update(visualizer.draw())
 
         while running:
-            current_time = pygame.time.get_ticks()
-
-            moved, waited = False, False
+            moved, waited, changed = False, False, False
 
-            for event in pygame.event.get():                # user closes window
-                if event.type == pygame.QUIT:
+            # Sleep until the first event arrives (or EVENT_TIMEOUT has passed, then it's a NOEVENT), then also take
+            # whatever else is waiting in the queue, so a burst of events leads to one redraw only.
+            for event in [pygame.event.wait(EVENT_TIMEOUT)] + pygame.event.get():
+                if event.type == pygame.QUIT:               # user closes window
                     running = False
-                elif event.type == pygame.KEYDOWN and event.unicode == ">" \
-                        and dungeon.map[player.y][player.x] == EXIT_TILE:       # user stands on ladder and leaves
-                    return
+                elif event.type in REDRAW_EVENTS:           # window uncovered or resized, repaint everything
+                    visualizer.invalidate()
+                    changed = True
+                elif event.type != pygame.KEYDOWN:
+                    continue
+                elif event.unicode == ">" and dungeon.map.get(player.x, player.y) == Tile.EXIT:
+                    if floors is None:
+                        return                              # user stands on ladder and leaves
+                    dungeon.entities["player"] = [player.x, player.y]
+                    dungeon = floors.descend()              # prefetched, so no waiting here
+                    player.enter(dungeon, *dungeon.entities.get("player", dungeon.stairs_up))
+                    visualizer.show(dungeon)
+                    moved = True
+                elif event.unicode == "<" and dungeon.map.get(player.x, player.y) == Tile.UP_STAIRS:
+                    dungeon.entities["player"] = [player.x, player.y]
+                    dungeon = floors.ascend()
+                    player.enter(dungeon, *dungeon.entities.get("player", dungeon.exit))
+                    visualizer.show(dungeon)
+                    moved = True
+                elif event.key in (pygame.K_q, pygame.K_ESCAPE):    # leave when q or ESC are pressed
+                    running = False
+                elif event.key == pygame.K_PERIOD:          # wait a round (repeats like the arrow keys now)
+                    waited = True
+                elif event.key in key_directions:
+                    moved = player.move(key_directions[event.key], dungeon) or moved   # moved is a True/False flag
 
-            keys = pygame.key.get_pressed()                 # get dict about currently pressed keys
+            if moved or changed:
+                dirty = visualizer.draw()                   # only what changed since the last frame
+                if dirty:
+                    pygame.display.update(dirty)
 
-            if keys[pygame.K_q] or keys[pygame.K_ESCAPE]:   # leave when q or ESC are pressed
-                running = False
+            if moved or waited:
+                rounds_counter += 1
+                pygame.display.set_caption(f"Dungeon Level -- Rounds: {rounds_counter:4} -- Current Position: {player.x:3}/{player.y:3}")
 
-            # there's still an issue here; PERIOD should have a cooldown effect like arrow keys
-            # too lazy to do this right now
-            if keys[pygame.K_PERIOD]:
-                waited = True
+        pygame.quit()
 
-            for direction, key_list in KNOWN_KEYS.items():
-                if any(keys[key] for key in key_list):  # check if any of the keys in key_list is pressed
-                    if not key_states[direction]["active"]:                             # first press, move immediately
-                        moved = player.move(direction, dungeon)                         # moved is a True/False flag
 
-                        key_states[direction]["active"] = True                          # set key active
-                        key_states[direction]["first_press"] = current_time             # remember timestamp
+class DungeonVisualizer:
+    """
+    My first experiment with pygame :)
 
-                    else:                                                               # key held down
-                        elapsed = current_time - key_states[direction]["first_press"]   # check time
-                        if elapsed > INITIAL_DELAY:                                     # waited long enough?
-                            if (current_time - key_states[direction]["last_move"]) > REPEAT_INTERVAL:   # really?
-                                moved = player.move(direction, dungeon)
-                                key_states[direction]["last_move"] = current_time
+    The first version cleared the window and drew every visible tile again, 60 times a second. Now the whole level
+    is drawn only once, fully revealed, onto an off-screen surface (the static layer). The window starts out empty
+    (all fog), and the fog mask remembers which tiles have been revealed. Every frame, draw() copies only the newly
+    revealed parts (from the dungeon's reveal log) from the static layer to the window, moves the player, and returns
+    the changed rectangles for pygame.display.update(). Most frames, that's nothing at all.
+    """
 
-                else:
-                    key_states[direction]["active"] = False                             # clear flags
+    def __init__(self, dungeon, player=None, size=None, tile_size=TILE_SIZE, headless=False):
+        """
+        Initialize data. size is the window size in tiles, the whole level by default.
 
+        A headless visualizer draws onto a plain off-screen surface instead of a window. It needs no display,
+        so it also works on servers (see Utilities.render_level_png).
+        """
 
-            visualizer.draw()
-            pygame.display.flip()
+        columns, rows = size if size is not None else (dungeon.map.width, dungeon.map.height)
 
-            if moved or waited:
-                rounds_counter += 1
-                pygame.display.set_caption(f"Dungeon Level -- Rounds: {rounds_counter:4} -- Current Position: {player.x:3}/{player.y:3}")
+        self.dungeon   = dungeon
+        self.player    = player
+        self.tile_size = tile_size
+        self.width     = columns * tile_size        # width and height in pixels
+        self.height    = rows    * tile_size
 
-            clock.tick(60)                                                              # cap at 60 FPS
+        if headless:
+            self.screen = pygame.Surface((self.width, self.height))
+        else:
+            self.screen = pygame.display.set_mode(
+                (self.width, self.height),
+                pygame.RESIZABLE                    # flags go here, eg. pygame.FULLSCREEN
+            )
 
-        pygame.quit()
+        self.static      = None                     # the fully revealed level, rendered on the first draw()
+        self.fog_mask    = None                     # one byte per tile, 1 = revealed on the screen
+        self.player_tile = None                     # where the player was drawn last
+        self.full_redraw = True
 
+        if not headless:
+            pygame.init()
+            pygame.display.set_caption("Dungeon Level")     # window heading
 
-class DungeonVisualizer:
-    """
-    My first experiment with pygame :)
-    """
+    def invalidate(self):
+        """
+        Makes the next draw() repaint the whole window, e.g. after the window was resized or uncovered.
+        """
 
-    def __init__(self, dungeon, player=None):
+        self.full_redraw = True
+
+    def show(self, dungeon):
         """
-        Initialize data.
+        Switches the window to another dungeon (of the same size), e.g. the next floor of a FloorStack.
         """
 
-        self.dungeon = dungeon
-        self.player  = player
-        self.width   = LEVEL_WIDTH  * TILE_SIZE     # width and height in pixels
-        self.height  = LEVEL_HEIGHT * TILE_SIZE
-        self.screen  = pygame.display.set_mode(
-            (self.width, self.height),
-            pygame.RESIZABLE                        # flags go here, eg. pygame.FULLSCREEN
-        )
+        self.dungeon     = dungeon
+        self.static      = None
+        self.player_tile = None
+        self.full_redraw = True
 
-        pygame.init()
-        pygame.display.set_caption("Dungeon Level") # window heading
+    def render_static(self):
+        """
+        Renders the whole level as if everything was visible.
+        """
+
+        size    = self.tile_size
+        surface = pygame.Surface((self.dungeon.map.width * size, self.dungeon.map.height * size))
+        surface.fill(COLOR_BACKGROUND)
+        self.draw_level(self.dungeon, surface=surface, everything=True)
+
+        return surface
+
+    def reveal(self, x, y, width, height):
+        """
+        Copies a rectangle of tiles from the static layer to the window and clears the fog there.
+        Returns the changed screen rectangle.
+        """
+
+        size = self.tile_size
+        rect = pygame.Rect(x * size, y * size, width * size, height * size)
+        self.screen.blit(self.static, rect, rect)
+
+        map_width = self.dungeon.map.width
+        for row in range(y, y + height):
+            self.fog_mask[row * map_width + x:row * map_width + x + width] = b"\x01" * width
+
+        return rect
+
+    def restore(self, x, y):
+        """
+        Paints a single tile as it looks without the player: from the static layer if revealed, else as fog.
+        """
+
+        size = self.tile_size
+        rect = pygame.Rect(x * size, y * size, size, size)
+        if self.fog_mask[y * self.dungeon.map.width + x]:
+            self.screen.blit(self.static, rect, rect)
+        else:
+            self.screen.fill(COLOR_BACKGROUND, rect)
+
+        return rect
 
     def draw(self):
         """
         Draws the dungeon using pygame, including a totally basic "fog of war"-like visibility system.
+        Returns the list of changed rectangles (empty if nothing changed).
         """
 
-        self.screen.fill(COLOR_BACKGROUND)
+        dungeon, dirty = self.dungeon, []
 
-        for room in self.dungeon.rooms:                                 # 1., draw the room floors
-            if room.visible:
-                for row in range(room.y, room.y + room.height):
-                    for column in range(room.x, room.x + room.width):
-                        current_room = pygame.Rect(column * TILE_SIZE, row * TILE_SIZE, TILE_SIZE, TILE_SIZE)   # x,y, w,h
-                        pygame.draw.rect(self.screen, COLOR_FLOOR, current_room)    # screen/window, color, element
+        if self.static is None:
+            self.static = self.render_static()
 
-        for corridor in self.dungeon.corridors:                         # 2., draw the corridors
-            for (x, y) in corridor.path:
-                if self.dungeon.corridor_visibility[y][x]:              # draw only if visible, skip if not
-                    rect = pygame.Rect(x * TILE_SIZE, y * TILE_SIZE, TILE_SIZE, TILE_SIZE)
-                    pygame.draw.rect(self.screen, COLOR_CORRIDOR, rect)
-
-        for room in self.dungeon.rooms:                                 # 3., draw the room walls
-            if room.visible:
-                pygame.draw.rect(self.screen, COLOR_WALL,               #     top wall
-                                 pygame.Rect(room.x * TILE_SIZE, room.y * TILE_SIZE, room.width * TILE_SIZE, TILE_SIZE))
-                pygame.draw.rect(self.screen, COLOR_WALL,               #     bottom wall
-                                 pygame.Rect(room.x * TILE_SIZE, (room.y + room.height - 1) * TILE_SIZE,
-                                             room.width * TILE_SIZE, TILE_SIZE))
-                pygame.draw.rect(self.screen, COLOR_WALL,               #     left wall
-                                 pygame.Rect(room.x * TILE_SIZE, room.y * TILE_SIZE, TILE_SIZE, room.height * TILE_SIZE))
-                pygame.draw.rect(self.screen, COLOR_WALL,               #     right wall
-                                 pygame.Rect((room.x + room.width - 1) * TILE_SIZE, room.y * TILE_SIZE, TILE_SIZE,
-                                             room.height * TILE_SIZE))
-
-        for row in range(LEVEL_HEIGHT):                                 # 4., draw the doors
-            for column in range(LEVEL_WIDTH):
-                if self.dungeon.map[row][column] == STANDARD_DOOR and self.dungeon.corridor_visibility[row][column]:
-                    rect = pygame.Rect(column * TILE_SIZE, row * TILE_SIZE, TILE_SIZE, TILE_SIZE)
-                    pygame.draw.rect(self.screen, COLOR_DOOR, rect)
-
-        if self.dungeon.exit:                                           # check if an exit has been generated
-            x, y = self.dungeon.exit                                    # get coordinates
-            exit_room = self.dungeon.get_room_at(x, y)                  # get room ID
-
-            if exit_room and exit_room.visible:                         # draw if the room is visible
-                rect = pygame.Rect(x * TILE_SIZE, y * TILE_SIZE, TILE_SIZE, TILE_SIZE)
-                pygame.draw.rect(self.screen, EXIT_COLOR, rect)
-
-        if self.player:                                                 # draw the player
-            rect = pygame.Rect(self.player.x * TILE_SIZE, self.player.y * TILE_SIZE, TILE_SIZE, TILE_SIZE)
+        if self.full_redraw:                                            # start from scratch: all fog, then
+            self.screen.fill(COLOR_BACKGROUND)                          # everything that is visible so far
+            self.fog_mask = bytearray(dungeon.map.width * dungeon.map.height)
+            for room in dungeon.rooms:
+                if dungeon.fog.room_explored(room.id):
+                    self.reveal(room.x, room.y, room.width, room.height)
+            for y, row in enumerate(dungeon.fog.explored):
+                for x in Utilities.set_bits(row):
+                    self.reveal(x, y, 1, 1)
+
+            dungeon.reveal_log.clear()
+            dirty.append(self.screen.get_rect())
+            self.player_tile = None
+            self.full_redraw = False
+
+        for rect in dungeon.reveal_log:                                 # new reveals since the last frame
+            dirty.append(self.reveal(*rect))
+        dungeon.reveal_log.clear()
+
+        if self.player and (dirty or (self.player.x, self.player.y) != self.player_tile):
+            if self.player_tile and self.player_tile != (self.player.x, self.player.y):
+                dirty.append(self.restore(*self.player_tile))           # the player left this tile
+
+            size = self.tile_size
+            rect = pygame.Rect(self.player.x * size, self.player.y * size, size, size)
             pygame.draw.rect(self.screen, PLAYER_COLOR, rect)
+            dirty.append(rect)
+            self.player_tile = (self.player.x, self.player.y)
+
+        return dirty
+
+    def draw_level(self, dungeon, origin=(0, 0), surface=None, everything=False):
+        """
+        Draws the visible parts of one level, with its top left tile at origin (in tiles), onto surface (the window
+        by default). With everything=True, the fog is ignored.
+        """
+
+        left, top = origin
+        surface   = surface if surface is not None else self.screen
+        size      = self.tile_size
+
+        def tile_rect(column, row, columns=1, rows=1):
+            return pygame.Rect((left + column) * size, (top + row) * size, columns * size, rows * size)
+
+        for room in dungeon.rooms:                                      # 1., draw the room floors
+            if everything or dungeon.fog.room_explored(room.id):        #     (one rectangle, not one per tile)
+                pygame.draw.rect(surface, COLOR_FLOOR, tile_rect(room.x, room.y, room.width, room.height))
+
+        for corridor in dungeon.corridors:                              # 2., draw the corridors
+            for (x, y) in corridor.path:
+                if everything or dungeon.fog.is_explored(x, y):         # draw only if visible, skip if not
+                    pygame.draw.rect(surface, COLOR_CORRIDOR, tile_rect(x, y))
+
+        for room in dungeon.rooms:                                      # 3., draw the room walls
+            if everything or dungeon.fog.room_explored(room.id):
+                pygame.draw.rect(surface, COLOR_WALL,                   #     top wall
+                                 tile_rect(room.x, room.y, room.width, 1))
+                pygame.draw.rect(surface, COLOR_WALL,                   #     bottom wall
+                                 tile_rect(room.x, room.y + room.height - 1, room.width, 1))
+                pygame.draw.rect(surface, COLOR_WALL,                   #     left wall
+                                 tile_rect(room.x, room.y, 1, room.height))
+                pygame.draw.rect(surface, COLOR_WALL,                   #     right wall
+                                 tile_rect(room.x + room.width - 1, room.y, 1, room.height))
+
+        tiles, width = dungeon.map.tiles, dungeon.map.width             # 4., draw the doors
+        index = tiles.find(Tile.DOOR)                                   #     bytearray.find skips to the next door
+        while index != -1:
+            row, column = divmod(index, width)
+            if everything or dungeon.fog.is_explored(column, row):
+                pygame.draw.rect(surface, COLOR_DOOR, tile_rect(column, row))
+            index = tiles.find(Tile.DOOR, index + 1)
+
+        if dungeon.exit:                                                # check if an exit has been generated
+            x, y = dungeon.exit                                         # get coordinates
+            exit_room = dungeon.get_room_at(x, y)                       # get room ID
+
+            if exit_room and (everything or dungeon.fog.room_explored(exit_room.id)):   # draw if the room is visible
+                pygame.draw.rect(surface, EXIT_COLOR, tile_rect(x, y))
+
+        if dungeon.stairs_up:                                           # same for the stairs up (FloorStack)
+            x, y = dungeon.stairs_up
+            stairs_room = dungeon.get_room_at(x, y)
+
+            if stairs_room and (everything or dungeon.fog.room_explored(stairs_room.id)):
+                pygame.draw.rect(surface, UP_STAIRS_COLOR, tile_rect(x, y))
 
     def generate(self):
         """
@@ -822,20 +4107,67 @@ class DungeonVisualizer:
         I found the main loop here: https://pygame.readthedocs.io/en/latest/1_intro/intro.html
         """
 
-        running = True
+        self.draw()                                 # calculate new map graphics
+        pygame.display.flip()                       # display new map graphics
 
-        while running:
-            for event in pygame.event.get():        # ask for events list
-                if event.type == pygame.QUIT:       # window closed?
-                    running = False
-                    break
+        while True:
+            event = pygame.event.wait()             # nothing changes unless something happens
+            if event.type == pygame.QUIT:           # window closed?
+                break
+            if event.type in REDRAW_EVENTS:         # window uncovered or resized
+                self.invalidate()
 
-            self.draw()                             # calculate new map graphics
-            pygame.display.flip()                   # display new map graphics
+            dirty = self.draw()
+            if dirty:
+                pygame.display.update(dirty)
 
         pygame.quit()
 
 
+class WorldVisualizer(DungeonVisualizer):
+    """
+    Shows a ChunkedWorld through a window of VIEW_WIDTH x VIEW_HEIGHT tiles that follows the player.
+    Only the chunks under the window are drawn, and they are pulled from the world as the window moves.
+    """
+
+    def __init__(self, world, player):
+        """
+        Initialize data. The window has a fixed size, the world has none.
+        """
+
+        super().__init__(world, player, size=(VIEW_WIDTH, VIEW_HEIGHT))
+
+    def draw(self):
+        """
+        Draws all chunks that overlap the window, with the player in the middle.
+        The window scrolls with every step, so there is no static layer here. But if the player didn't move and
+        nothing was revealed, nothing is drawn either. Returns the changed rectangles, like DungeonVisualizer.draw.
+        """
+
+        world     = self.dungeon
+        left, top = self.player.x - VIEW_WIDTH // 2, self.player.y - VIEW_HEIGHT // 2
+        chunks    = [(cx, cy, world.get_chunk(cx, cy)) for cx, cy in world.chunks_in(left, top, VIEW_WIDTH, VIEW_HEIGHT)]
+
+        moved = (self.player.x, self.player.y) != self.player_tile
+        if not (self.full_redraw or moved or any(chunk.reveal_log for _, _, chunk in chunks)):
+            return []
+
+        self.screen.fill(COLOR_BACKGROUND)
+        for cx, cy, chunk in chunks:
+            origin = (cx * world.config.width - left, cy * world.config.height - top)
+            self.draw_level(chunk, origin)
+            chunk.reveal_log.clear()
+
+        size = self.tile_size
+        rect = pygame.Rect((VIEW_WIDTH // 2) * size, (VIEW_HEIGHT // 2) * size, size, size)
+        pygame.draw.rect(self.screen, PLAYER_COLOR, rect)
+
+        self.player_tile = (self.player.x, self.player.y)
+        self.full_redraw = False
+
+        return [self.screen.get_rect()]
+
+
 class Player:
     """
     This section contains a simple logic for the Player character.
@@ -907,20 +4239,23 @@ class Player:
         Check if position is within bounds and walkable
         """
 
-        return (
-                0 <= x < LEVEL_WIDTH  and
-                0 <= y < LEVEL_HEIGHT and
-                dungeon.map[y][x] in (FLOOR_TILE, CORRIDOR_TILE, STANDARD_DOOR, EXIT_TILE)
-        )
+        return dungeon.map.is_walkable(x, y)
 
     def reveal_room(self, dungeon):
         """
         Reveal room when the player has moved in
         """
 
-        for room in dungeon.rooms:
-            if room.contains(self.x, self.y):           # maybe not the most elegant way to check
-                room.visible = True
+        dungeon.reveal_room_at(self.x, self.y)
+
+    def enter(self, dungeon, x, y):
+        """
+        Puts the player at x,y in another dungeon (like the next floor down the stairs), and looks around there.
+        """
+
+        self.x, self.y = x, y
+        self.reveal_room(dungeon)
+        dungeon.update_corridor_visibility(self.x, self.y)
 
 
 def main():
@@ -928,11 +4263,32 @@ def main():
 
     if RUNNING_MODE["brute_force"]:
         Utilities.test_mode()
+    elif RUNNING_MODE["batch"]:
+        Utilities.batch_mode()
+    elif RUNNING_MODE["archive"]:
+        Utilities.archive_mode()
+    elif RUNNING_MODE["benchmark"]:
+        Utilities.benchmark_mode()
+    elif RUNNING_MODE["analytics"]:
+        Utilities.analytics_mode()
+    elif RUNNING_MODE["corpus"]:
+        Utilities.corpus_mode()
+    elif RUNNING_MODE["render"]:
+        Utilities.render_mode()
+    elif RUNNING_MODE["router_test"]:
+        Utilities.compare_routers()
     elif RUNNING_MODE["level_gen"]:
         Utilities.display_loop()
     elif RUNNING_MODE["play"]:
         Utilities.game_loop()
         print("\n\nYou survived the bridge of Khazad-dûm and escaped the dungeon.")
+    elif RUNNING_MODE["floors"]:
+        with FloorStack(FLOOR_SEED) as floors:
+            Utilities.game_loop(floors=floors)
+        print(f"\n\nYou made it down to floor {floors.depth + 1}... and no further.")
+    elif RUNNING_MODE["world"]:
+        Utilities.game_loop(ChunkedWorld(WORLD_SEED))
+        print("\n\nYou found a way out of the endless dungeon.")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
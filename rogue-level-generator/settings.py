@@ -13,11 +13,68 @@ OUTPUT_MODE = {
 
 RUNNING_MODE = {
     "brute_force": False,   # create a large number of levels to check if the code crashes
+    "batch"      : False,   # create a large number of levels on all cores, one explicit seed per level
+    "analytics"  : False,   # distributions of room counts, corridor lengths, distances etc. over many levels (NumPy)
+    "benchmark"  : False,   # time every stage of level generation on fixed seeds and compare with a baseline
+    "archive"    : False,   # pack a large number of levels into a level archive file
+    "corpus"     : False,   # add a large number of levels to the searchable level corpus
+    "render"     : False,   # render a large number of levels to PNG files, no display needed
+    "router_test": False,   # compare the corridor routers (expanded nodes and time) on the same levels
     "level_gen"  : False,   # create levels
-    "play"       : True     # gameplay
+    "play"       : True,    # gameplay
+    "floors"     : False,   # gameplay on floor after floor, connected by stairs
+    "world"      : False    # gameplay in an endless world of chunks
 }
 
 TEST_NUM  = 1000            # numbers of levels to create in "brute force" mode
+ROUTER_TEST_NUM  = 500      # numbers of levels to create per router in "router_test" mode (seeds 0, 1, 2, ...)
+
+BATCH_NUM        = 10000    # numbers of levels to create in "batch" mode
+BATCH_SEED       = 0        # seed of the first level, the following levels use BATCH_SEED + 1, + 2, ...
+BATCH_WORKERS    = None     # number of worker processes, None means one per CPU core
+BATCH_CHUNK_SIZE = 64       # seeds handed to a worker at once (fewer round trips between the processes)
+BATCH_PRESET     = "console"    # generator preset (see GENERATOR_PRESETS below) for "batch" mode
+BATCH_VALIDATE   = True     # check every level for connectivity in the workers, and drop the broken ones
+BATCH_INSTRUMENTATION = False      # count and time what happens while each level is generated (see Instrumentation)
+INSTRUMENTATION_FILE  = "level_stats.jsonl"     # where "batch" mode writes these stats, one line per level
+
+BENCHMARK_NUM      = 500    # numbers of levels to time in "benchmark" mode (seeds from BENCHMARK_SEED on)
+BENCHMARK_SEED     = 0
+BENCHMARK_WARMUP   = 50     # levels generated before timing starts (with other seeds, they are not counted)
+BENCHMARK_PRESET   = "console"
+BENCHMARK_FILE     = "benchmark.json"           # where the result goes
+BENCHMARK_BASELINE = "benchmark_baseline.json"  # result to compare with (None or a missing file: no comparison)
+BENCHMARK_TOLERANCE = 0.10  # stages more than 10 % slower (p50 or p95) than in the baseline are reported
+
+SEED_BITS        = 63       # size of the random seeds picked for levels generated without an explicit seed
+LEVEL_CACHE_SIZE = 32       # levels kept in memory by the LevelCache, all others are regenerated from their seed
+
+ARCHIVE_NUM      = 10000    # numbers of levels to pack in "archive" mode (seeds from BATCH_SEED on)
+ARCHIVE_FILE     = "levels.rla"     # the level archive written in "archive" mode
+
+CORPUS_NUM       = 10000    # numbers of levels to add in "corpus" mode (seeds from BATCH_SEED on)
+CORPUS_FILE      = "levels.db"      # the SQLite database of the level corpus
+CORPUS_TRANSACTION_SIZE = 1000      # levels inserted per transaction
+
+ANALYTICS_NUM        = 10000    # numbers of levels to analyze in "analytics" mode (seeds from BATCH_SEED on)
+ANALYTICS_CHUNK_SIZE = 2048     # levels analyzed at once (bounds the memory of the arrays)
+ANALYTICS_BINS       = 12       # bins of the corridor length histogram
+ANALYTICS_FILE       = "analytics.npz"  # all arrays of the analysis, for plotting or comparing parameter sets
+
+RENDER_NUM       = 1000     # numbers of levels to render in "render" mode (seeds from BATCH_SEED on)
+RENDER_DIRECTORY = "renders"    # where the PNG files go
+RENDER_PRESET    = "console"    # generator preset for "render" mode
+RENDER_TILE_SIZE = 4        # tile size in pixels for rendered files (thumbnails, so smaller than on screen)
+
+WORLD_SEED       = None     # seed of the endless world in "world" mode, None picks a random one
+WORLD_PRESET     = "chunk"  # generator preset (see GENERATOR_PRESETS below) for the chunks of the world
+CHUNK_CACHE_SIZE = 16       # chunks kept in memory, all others are regenerated from their seed when needed
+
+FLOOR_SEED       = None     # seed of the dungeon in "floors" mode, None picks a random one
+FLOOR_PRESET     = "console"    # generator preset for the floors
+FLOOR_PREFETCH   = True     # generate the next floor in a worker process while the player is on the current one
+FLOOR_CACHE_BYTES     = 256 * 1024  # snapshots of other floors kept in memory, the rest is written to disk
+FLOOR_SPILL_DIRECTORY = None        # where they go, None means a temporary directory
 
 AUTO_GEN  = False           # run an endless loop of dungeon generation, best in ASCII mode
 DELAY     = 5               # show level for n seconds
@@ -39,6 +96,8 @@ MIN_ROOM_SIZE =    5    # minimal and maximal breadth and width of rooms
 MAX_ROOM_SIZE =   10
 ROOM_BUFFER   =    3    # buffer between rooms
 MAX_ATTEMPTS  = 1000    # max attempts of room generation attempts
+PLACEMENT_PROBES =  8   # random positions tried for a room before picking from the list of all free positions
+SAT_BLOCK_SIZE   = 16   # the room placer keeps one summed-area table per block of 16 x 16 tiles
 
 MIN_ROOMS     =    5    # minimal and maximal number of rooms to be created
 MAX_ROOMS     =   12
@@ -51,6 +110,36 @@ THRESHOLD_DISTANCE_FOR_EXTRA_CORRIDORS  = 25
 # 10 % to 50 %, based on the level density (i.e., the number of rooms). Lots of parameters to play with!
 PROBABILITY_FOR_EXTRA_CORRIDOR_CREATION =  0.25
 
+CORRIDOR_ROUTER = "bfs"             # router for corridors that are no simple L-shape: "bfs", "astar", or "jps"
+BFS_BIDIRECTIONAL_DISTANCE = 40     # BFS corridors between doors at least this far apart search from both ends
+DENSE_MST_LIMIT = 500               # up to this many rooms, the MST compares all room pairs (Prim), above it only
+                                    # the few candidate pairs per room that can be part of an MST (Kruskal)
+
+
+# Generator Presets
+# The settings above are the defaults of a GeneratorConfig ("console"). A preset only lists what it changes, and
+# levels of different presets can be generated side by side in the same process.
+
+GENERATOR_PRESETS = {
+    "console"  : {},                                    # 80 x 25, as above
+    "chunk"    : {"width": 64, "height": 40},           # one chunk of an endless world
+    "overworld": {
+        "width"       : 2000,
+        "height"      : 2000,
+        "min_rooms"   : 3000,
+        "max_rooms"   : 4000,
+        "max_attempts": 40000,
+        "router"      : "astar"                         # most corridors need a router here, A* expands far less
+    }
+}
+
+
+# Field of View
+
+USE_FIELD_OF_VIEW = False   # True: the player sees FOV_RADIUS tiles far (shadowcasting), False: only the 8 neighbors
+FOV_RADIUS        =     8   # view distance in tiles
+FOV_CACHE_SIZE    =  4096   # field of view results kept per level, by (x, y, radius)
+
 
 # ASCII Representation
 
@@ -61,12 +150,15 @@ STANDARD_DOOR = "+"
 CORRIDOR_TILE = "#"
 ROCK_TILE     = " "
 EXIT_TILE     = ">"
+UP_STAIRS_TILE = "<"
 PLAYER_TILE   = "@"
 
 
 # Graphics Output
 
 TILE_SIZE        = 20       # tile size in pixels
+VIEW_WIDTH       = 64       # window size in tiles when playing an endless world
+VIEW_HEIGHT      = 40
 COLOR_FLOOR      = THECOLORS["grey40"]
 COLOR_WALL       = THECOLORS["black"]
 COLOR_CORRIDOR   = THECOLORS["grey"]
@@ -75,6 +167,10 @@ COLOR_BACKGROUND = THECOLORS["ghostwhite"]
 PLAYER_COLOR     = THECOLORS["red"]
 TEXT_COLOR       = THECOLORS["blue"]
 EXIT_COLOR       = THECOLORS["green"]
+UP_STAIRS_COLOR  = THECOLORS["cyan"]
+
+
+REDRAW_EVENTS    = (pygame.VIDEOEXPOSE, pygame.VIDEORESIZE, pygame.WINDOWEXPOSED)     # events that need a full repaint
 
 
 # Keyboard Behavior
@@ -82,6 +178,7 @@ EXIT_COLOR       = THECOLORS["green"]
 
 INITIAL_DELAY   = 400  # delay before repeats start with pressed keys (in ms)
 REPEAT_INTERVAL =  40  # delay between repeats
+EVENT_TIMEOUT   = 1000 # the game loop sleeps up to this long while waiting for input (in ms)
 
 
 # Movement Keys